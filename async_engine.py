@@ -0,0 +1,216 @@
+import asyncio
+import time
+
+import httpx
+
+import metrics
+import pipeline
+import postprocess
+import rate_limit
+import resilience
+import utils
+from job_store import pending_urls
+from key_pool import KeyPool
+
+# A single event loop drives every request and download; the semaphore is
+# the only thing bounding how many are in flight at once.
+DEFAULT_CONCURRENCY = 20
+
+async def fetch_image(http, url, output_path):
+    """
+    Async counterpart of utils.fetch_image on the shared async HTTP client:
+    same .part file, Range resume and checks, raising on failure. File
+    I/O runs on worker threads so a slow disk never stalls the loop.
+    """
+    part_path = utils.partial_path(output_path)
+    offset = await asyncio.to_thread(utils.file_offset, part_path)
+    async with http.stream("GET", url, headers=utils.download_headers(offset)) as response:
+        if response.status_code != 416:
+            response.raise_for_status()
+        mode, expected_size = await asyncio.to_thread(
+            utils.plan_download, output_path, response.status_code, response.headers, offset
+        )
+        if mode != "done":
+            f = await asyncio.to_thread(open, part_path, 'ab' if mode == "append" else 'wb')
+            try:
+                async for chunk in response.aiter_bytes(utils.DOWNLOAD_CHUNK_SIZE):
+                    await asyncio.to_thread(f.write, chunk)
+            finally:
+                await asyncio.to_thread(f.close)
+    await asyncio.to_thread(utils.finish_download, output_path, expected_size)
+
+async def consume_image_stream(stream, on_url):
+    """
+    Async counterpart of utils.consume_image_stream.
+    """
+    scanner = utils.StreamingURLScanner()
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            for url in scanner.feed(chunk.choices[0].delta.content):
+                on_url(url)
+    except Exception:
+        if not scanner.found:
+            raise
+        return scanner.found, scanner.text
+    finally:
+        await stream.close()
+    for url in scanner.finish():
+        on_url(url)
+    return scanner.found, scanner.text
+
+async def generate_one(key_pool, http, semaphore, task, on_log, stream=False, job_store=None):
+    """
+    Run one generation task (see pipeline for its shape) while holding a
+    semaphore slot, downloading every image in the reply concurrently. The
+    asyncio variant of pipeline.Pipeline: same steps, same results,
+    checkpoints and metrics.
+    Returns a list of result dicts ({status, file_path, model, prompt,
+    request_id, ...}), one per image, or a single failed result.
+    """
+    model = task["model"]
+    request = pipeline.new_request(task)
+
+    async with semaphore:
+        started = time.monotonic()
+
+        async def download_one(index, image_url):
+            # Claiming the name creates a file; keep that off the loop too
+            output_file = await asyncio.to_thread(utils.get_unique_filename, task["output_file"])
+
+            async def download():
+                download_started = time.monotonic()
+                try:
+                    await fetch_image(http, image_url, output_file)
+                except Exception as e:
+                    raise resilience.GenerationError(resilience.DOWNLOAD, f"Download failed: {e}") from e
+                metrics.METRICS.record_download(model, metrics.file_size(output_file),
+                                                time.monotonic() - download_started)
+
+            try:
+                await resilience.call_with_retry_async(
+                    download, on_retry=pipeline.retry_logger(on_log, task, "Download")
+                )
+            except resilience.GenerationError as e:
+                on_log(f"❌ [{pipeline.label(task)}] Failed to download image {index+1}: {e}")
+                await asyncio.to_thread(utils.release_filename, output_file)
+                await asyncio.to_thread(pipeline.checkpoint_download, job_store, task, image_url, None)
+                metrics.METRICS.record_image(model, False)
+                return pipeline.image_result(request, index, error=e.kind, started=started)
+
+            extra = {}
+            if postprocess.enabled(task.get("postprocess")):
+                # CPU-bound re-encode runs on the process pool; the loop keeps going
+                job = None
+                try:
+                    with metrics.METRICS.timer(model, metrics.POSTPROCESS):
+                        job = postprocess.submit(output_file, task["postprocess"])
+                        info = await asyncio.wrap_future(job)
+                except (Exception, asyncio.CancelledError) as e:
+                    # A job cancelled by postprocess.shutdown is a failed conversion;
+                    # cancelling this coroutine itself still propagates
+                    if isinstance(e, asyncio.CancelledError) and not (job and job.cancelled()):
+                        raise
+                    on_log(f"⚠️ [{pipeline.label(task)}] Post-processing failed, keeping original ({e!r}).")
+                else:
+                    output_file, extra = pipeline.postprocessed(on_log, task, info)
+            on_log(f"✅ [{pipeline.label(task)}] Saved to {output_file}")
+            await asyncio.to_thread(pipeline.checkpoint_download, job_store, task, image_url, output_file)
+            result = pipeline.image_result(request, index, output_file, started=started, **extra)
+            metrics.METRICS.record_image(model, True, result["elapsed"])
+            return result
+
+        # Downloads start the moment each URL is known
+        downloads = []
+        found = []
+        def start_download(image_url):
+            found.append(image_url)
+            downloads.append(asyncio.ensure_future(download_one(len(downloads), image_url)))
+
+        if task.get("urls"):
+            # Resumed item: the reply is already known, fetch what is missing
+            for image_url in pending_urls(task):
+                downloads.append(asyncio.ensure_future(download_one(task["urls"].index(image_url), image_url)))
+            return list(await asyncio.gather(*downloads))
+
+        async def generate():
+            # Lease the least-loaded healthy key for this attempt
+            with key_pool.lease() as key:
+                with metrics.METRICS.timer(model, metrics.CLIENT):
+                    client = key.async_client
+
+                async def create():
+                    # Timed inside the limiter so rate-limit waits don't count
+                    with metrics.METRICS.timer(model, metrics.REQUEST):
+                        return await client.chat.completions.create(
+                            model=model,
+                            messages=[{"role": "user", "content": task["prompt"]}],
+                            stream=stream
+                        )
+
+                response = await rate_limit.limited_call_async(key.api_key, model, create)
+                with metrics.METRICS.timer(model, metrics.EXTRACT):
+                    if stream:
+                        image_urls, content = await consume_image_stream(response, start_download)
+                    else:
+                        content = response.choices[0].message.content or ""
+                        image_urls = utils.get_image_urls(content)
+                        for image_url in image_urls:
+                            start_download(image_url)
+            if not image_urls:
+                kind = rate_limit.classify_reply(key.api_key, model, content)
+                raise resilience.GenerationError(kind, "No image URL found in response.", content)
+
+        error = None
+        try:
+            await resilience.call_with_retry_async(
+                generate, breaker=resilience.BREAKERS.get(model),
+                on_retry=pipeline.retry_logger(on_log, task, "Request")
+            )
+        except Exception as e:
+            error = pipeline.log_request_failure(on_log, task, e)
+        # Images found before a failure are still worth saving
+        metrics.METRICS.record_request(model, bool(found))
+        # sqlite writes block; run them beside the loop, not on it
+        await asyncio.to_thread(pipeline.checkpoint_request, job_store, task, found, error)
+        if not downloads:
+            return [pipeline.image_result(request, None, error=error, started=started)]
+
+        return list(await asyncio.gather(*downloads))
+
+async def run_batch(tasks, api_keys=None, concurrency=DEFAULT_CONCURRENCY, timeout=300, on_log=print,
+                    stream=False, job_store=None):
+    """
+    Run every task on one event loop with at most `concurrency` in flight,
+    spread across `api_keys` (default: from the environment). With
+    `stream`, replies are streamed and each download starts as soon as the
+    image URL is complete. With `job_store`, tasks are job items (see
+    job_store.JobStore) and are checkpointed as they progress.
+    Returns one result dict per image (or per failed request), in
+    completion order.
+    """
+    key_pool = KeyPool(api_keys or utils.get_api_keys(), timeout=timeout)
+    concurrency = max(1, concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    connect_timeout, read_timeout = utils.DOWNLOAD_TIMEOUT
+    download_timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+
+    results = []
+    try:
+        async with httpx.AsyncClient(limits=limits, timeout=download_timeout, follow_redirects=True) as http:
+            jobs = [generate_one(key_pool, http, semaphore, task, on_log, stream, job_store)
+                    for task in tasks]
+            for job in asyncio.as_completed(jobs):
+                results.extend(await job)
+    finally:
+        await key_pool.aclose()
+
+    return results
+
+def run(tasks, **kwargs):
+    """
+    Blocking entry point for scripts: run_batch on a fresh event loop.
+    """
+    return asyncio.run(run_batch(tasks, **kwargs))
@@ -0,0 +1,442 @@
+"""
+Benchmark the generation pipeline against a local mock Poe server.
+
+Starts an OpenAI-compatible chat completions stub and an image host in a
+separate process (so its CPU and memory don't count), points the clients
+at it via utils.POE_BASE_URL, then runs the sequential CLI path, the
+async engine and the GUI's GenerationWorker over a matrix of batch sizes
+and concurrency levels. No API key or network access is needed and no
+points are spent.
+
+    python benchmark.py
+    python benchmark.py --modes async worker --batch 50 200 --concurrency 5 20 50
+    python benchmark.py --latency 2 --error-rate 0.05 --reply multi --stream
+    python benchmark.py --truncate-rate 0.2
+    python benchmark.py --startup 5
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import random
+import re
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODEL = "Mock-Image"
+API_KEY = "benchmark"
+PROMPT = "A lighthouse on a cliff at dusk, benchmark run"
+REPLY_FORMATS = ("markdown", "raw", "multi", "text")
+
+# ================= Mock server =================
+def make_png(width, height):
+    """
+    A valid RGB PNG of random noise, so it compresses about as badly as a
+    real generated image (~3 bytes per pixel).
+    """
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+    rows = b"".join(b"\x00" + os.urandom(width * 3) for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows, 1))
+            + chunk(b"IEND", b""))
+
+def jittered(seconds, jitter):
+    return max(0.0, seconds * random.uniform(1 - jitter, 1 + jitter))
+
+class MockPoeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def reply_content(self):
+        config = self.server.config
+        urls = [f"{self.server.base_url}/images/{uuid.uuid4().hex}.png"
+                for _ in range(config["images_per_reply"] if config["reply"] == "multi" else 1)]
+        if config["reply"] == "raw":
+            return f"Done: {urls[0]}"
+        if config["reply"] == "text":
+            return "Sorry, I could not generate that image."
+        return "Here you go:\n\n" + "\n\n".join(f"![image]({url})" for url in urls)
+
+    def do_POST(self):
+        config = self.server.config
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            request = {}
+        delay = jittered(config["latency"], config["jitter"])
+
+        if random.random() < config["error_rate"]:
+            time.sleep(delay / 2)
+            status = config["error_status"]
+            headers = {"Retry-After": "1"} if status == 429 else None
+            self.send_json(status, {"error": {"message": "mock failure", "type": "server_error"}}, headers)
+            return
+
+        content = self.reply_content()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = request.get("model") or MODEL
+
+        if not request.get("stream"):
+            time.sleep(delay)
+            self.send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+            return
+
+        # Server-sent events, spreading the latency over the pieces
+        pieces = [content[i:i + 24] for i in range(0, len(content), 24)]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for piece in pieces:
+            time.sleep(delay / len(pieces))
+            self.write_event({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            })
+        self.write_event({
+            "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        })
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def write_event(self, payload):
+        self.wfile.write(b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if not self.path.startswith("/images/"):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+        time.sleep(jittered(self.server.config["image_latency"], self.server.config["jitter"]))
+        image = self.server.image
+        match = re.match(r"bytes=(\d+)-$", self.headers.get("Range") or "")
+        start = int(match.group(1)) if match else 0
+        if start >= len(image):
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{len(image)}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = image[start:]
+        self.send_response(206 if start else 200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{len(image) - 1}/{len(image)}")
+        self.end_headers()
+        if random.random() < self.server.config["truncate_rate"]:
+            # Announce the full length but hang up halfway through
+            self.close_connection = True
+            body = body[:len(body) // 2]
+        self.wfile.write(body)
+
+def serve(config, ready):
+    """
+    Child process entry point: run the mock server until terminated,
+    reporting its base URL through `ready`.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", config["port"]), MockPoeHandler)
+    server.daemon_threads = True
+    server.config = config
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    server.image = make_png(config["image_size"], config["image_size"])
+    ready.put(server.base_url)
+    server.serve_forever()
+
+def start_mock_server(config):
+    """
+    Start the mock server in its own process. Returns (process, base_url).
+    """
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    process = context.Process(target=serve, args=(config, ready), daemon=True)
+    process.start()
+    return process, ready.get(timeout=30)
+
+# ================= Scenarios =================
+def run_sequential(tasks, concurrency, stream, download_workers):
+    import poe_gen
+    from key_pool import KeyPool
+    # poe_gen prints a progress line per step; keep the report readable
+    with redirect_stdout(io.StringIO()):
+        return poe_gen.run_sequential(KeyPool([API_KEY], timeout=300), tasks, stream=stream,
+                                      download_workers=download_workers)
+
+def run_async(tasks, concurrency, stream, download_workers):
+    import async_engine
+    return async_engine.run(tasks, api_keys=[API_KEY], concurrency=concurrency, stream=stream,
+                            on_log=lambda message: None)
+
+def run_worker(tasks, concurrency, stream, download_workers):
+    import gui
+    from PyQt6.QtCore import Qt
+    from key_pool import KeyPool
+    gui.OUTPUT_DIR = os.path.dirname(tasks[0]["output_file"])
+    results = []
+    worker = gui.GenerationWorker(KeyPool([API_KEY], timeout=300), MODEL, PROMPT, len(tasks), "bench",
+                                  concurrency, download_workers, stream=stream)
+    # No event loop here: deliver results on the emitting thread
+    worker.result_signal.connect(results.append, Qt.ConnectionType.DirectConnection)
+    worker.run()
+    return results
+
+RUNNERS = {
+    "sequential": run_sequential,
+    "async": run_async,
+    "worker": run_worker,
+}
+
+def process_rss():
+    """
+    Current resident set size in bytes (psutil), or None without psutil.
+    """
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+def lifetime_peak_rss():
+    """
+    Peak resident set size of this process so far, from getrusage.
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reports KiB
+
+class PeakRSS:
+    """
+    Peak resident memory while the body runs, native allocations (Qt, PIL,
+    SSL buffers) included. Polls psutil when it is installed; otherwise
+    falls back to getrusage's peak, which covers the whole process
+    lifetime and so never drops between scenarios.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self.stop = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        rss = process_rss()
+        if rss is not None:
+            self.peak = rss
+            self.thread = threading.Thread(target=self.poll, daemon=True)
+            self.thread.start()
+        return self
+
+    def poll(self):
+        while not self.stop.wait(self.interval):
+            self.peak = max(self.peak, process_rss())
+
+    def __exit__(self, *exc_info):
+        if self.thread is None:
+            self.peak = lifetime_peak_rss()
+            return
+        self.stop.set()
+        self.thread.join()
+        self.peak = max(self.peak, process_rss())
+
+def run_scenario(mode, batch_size, concurrency, stream, download_workers):
+    """
+    Run one batch and return its measurements.
+    """
+    import metrics
+    import rate_limit
+    import resilience
+
+    # Fresh state per scenario: no throttling, no breaker carried over
+    metrics.METRICS.reset()
+    resilience.BREAKERS = resilience.BreakerRegistry()
+    rate_limit.LIMITER = rate_limit.RateLimiter(key_rate=10 ** 9)
+
+    with tempfile.TemporaryDirectory(prefix="poe_bench_") as output_dir:
+        tasks = [{"model": MODEL, "prompt": PROMPT, "output_file": os.path.join(output_dir, "bench.png")}
+                 for _ in range(batch_size)]
+        with PeakRSS() as memory:
+            cpu_started = time.process_time()
+            started = time.monotonic()
+            RUNNERS[mode](tasks, concurrency, stream, download_workers)
+            wall = time.monotonic() - started
+            cpu = time.process_time() - cpu_started
+
+    data = metrics.METRICS.snapshot().get(MODEL, {})
+    total = data.get("stages", {}).get(metrics.TOTAL, {})
+    request = data.get("stages", {}).get(metrics.REQUEST, {})
+    images = data.get("images", 0)
+    return {
+        "mode": mode,
+        "batch": batch_size,
+        "concurrency": concurrency,
+        "images": images,
+        "attempted": images + data.get("failed_images", 0),
+        "wall_seconds": wall,
+        "images_per_minute": images / wall * 60 if wall > 0 else 0.0,
+        "p50": total.get("p50", 0.0),
+        "p95": total.get("p95", 0.0),
+        "p99": total.get("p99", 0.0),
+        "request_p95": request.get("p95", 0.0),
+        "cpu_seconds": cpu,
+        "cpu_ms_per_image": cpu / images * 1000 if images else 0.0,
+        "peak_rss_mb": memory.peak / 1e6,
+        "download_mb_per_second": data.get("download_bytes_per_second", 0.0) / 1e6,
+    }
+
+def measure_startup(runs):
+    """
+    Launch `gui.py --measure-startup` `runs` times and report the median and
+    best time to first paint and to history being ready (milliseconds).
+    """
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    gui_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gui.py")
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, gui_path, "--measure-startup"], env=env,
+                                capture_output=True, text=True, timeout=120,
+                                cwd=os.path.dirname(gui_path)).stdout
+        lines = [line for line in output.splitlines() if line.startswith("{")]
+        if not lines:
+            raise RuntimeError("gui.py did not report its startup time")
+        samples.append(json.loads(lines[-1]))
+
+    result = {}
+    for key in ("first_paint_ms", "history_ready_ms"):
+        values = [sample[key] for sample in samples]
+        result[key] = {"median": statistics.median(values), "best": min(values)}
+    print(f"GUI startup over {runs} run(s): "
+          f"first paint {result['first_paint_ms']['median']:.0f} ms (best {result['first_paint_ms']['best']:.0f}), "
+          f"history ready {result['history_ready_ms']['median']:.0f} ms "
+          f"(best {result['history_ready_ms']['best']:.0f})")
+    return result
+
+def print_row(row):
+    print(f"{row['mode']:<11}{row['batch']:>6}{row['concurrency']:>6}"
+          f"{row['images']:>6}/{row['attempted']:<5}{row['wall_seconds']:>8.1f}{row['images_per_minute']:>9.1f}"
+          f"{row['p50']:>7.2f}{row['p95']:>7.2f}{row['p99']:>7.2f}"
+          f"{row['cpu_seconds']:>7.2f}{row['cpu_ms_per_image']:>8.1f}{row['peak_rss_mb']:>8.1f}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the generation pipeline against a local mock server.")
+    parser.add_argument("--modes", nargs="+", choices=sorted(RUNNERS), default=["sequential", "async", "worker"],
+                        help="code paths to drive")
+    parser.add_argument("--batch", nargs="+", type=int, default=[20], help="batch sizes")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 5, 20],
+                        help="concurrency levels (sequential runs once per batch size)")
+    parser.add_argument("--download-workers", type=int, default=4, help="download threads (sequential/worker)")
+    parser.add_argument("--stream", action="store_true", help="stream completions")
+    parser.add_argument("--latency", type=float, default=0.5, help="mean completion latency (seconds)")
+    parser.add_argument("--image-latency", type=float, default=0.05, help="mean image time-to-first-byte (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.3, help="relative latency jitter (0-1)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of completions that fail")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP status of failed completions")
+    parser.add_argument("--truncate-rate", type=float, default=0.0,
+                        help="share of image downloads cut off halfway (exercises resume)")
+    parser.add_argument("--reply", choices=REPLY_FORMATS, default="markdown", help="reply format")
+    parser.add_argument("--images-per-reply", type=int, default=4, help="images per reply with --reply multi")
+    parser.add_argument("--image-size", type=int, default=512, help="mock image width/height in pixels")
+    parser.add_argument("--port", type=int, default=0, help="mock server port (default: any free port)")
+    parser.add_argument("--startup", type=int, metavar="RUNS",
+                        help="only measure GUI cold start over RUNS launches")
+    parser.add_argument("--json", metavar="FILE", help="also write the results to FILE")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.startup:
+        result = measure_startup(args.startup)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump({"startup": result}, f, indent=2)
+        return 0
+
+    config = {
+        "port": args.port,
+        "latency": args.latency,
+        "image_latency": args.image_latency,
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "error_status": args.error_status,
+        "truncate_rate": args.truncate_rate,
+        "reply": args.reply,
+        "images_per_reply": args.images_per_reply,
+        "image_size": args.image_size,
+    }
+    server, base_url = start_mock_server(config)
+    print(f"Mock Poe server at {base_url} (latency {args.latency}s, error rate {args.error_rate:.0%}, "
+          f"reply '{args.reply}', {args.image_size}px images)")
+
+    import utils
+    utils.POE_BASE_URL = f"{base_url}/v1"
+    scenarios = []
+    for batch_size in args.batch:
+        for mode in args.modes:
+            levels = [1] if mode == "sequential" else args.concurrency
+            scenarios.extend((mode, batch_size, concurrency) for concurrency in levels)
+
+    print(f"{'mode':<11}{'batch':>6}{'conc':>6}{'ok':>6}/{'all':<5}{'wall s':>8}{'img/min':>9}"
+          f"{'p50':>7}{'p95':>7}{'p99':>7}{'cpu s':>7}{'cpu ms':>8}{'RSS MB':>8}")
+    rows = []
+    try:
+        # One untimed request per mode first, so the first scenario doesn't
+        # pay for cold imports (openai, httpx, Qt) and connection setup
+        for mode in args.modes:
+            try:
+                run_scenario(mode, 1, 1, args.stream, args.download_workers)
+            except ImportError:
+                pass
+        for mode, batch_size, concurrency in scenarios:
+            try:
+                row = run_scenario(mode, batch_size, concurrency, args.stream, args.download_workers)
+            except ImportError as e:
+                print(f"{mode:<11}skipped: {e}")
+                continue
+            rows.append(row)
+            print_row(row)
+    finally:
+        server.terminate()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"server": config, "stream": args.stream, "results": rows}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,31 +1,58 @@
 import sys
+import time
+# Startup is timed from here to the first paint (see PoeImageStudio.report_startup)
+STARTUP_STARTED = time.perf_counter()
 import json
+import logging
+import logging.handlers
 import os
-import time
-from datetime import datetime
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
-                             QListWidget, QTextEdit, QLabel, QLineEdit, QPushButton, 
-                             QComboBox, QSpinBox, QSplitter, QMessageBox, QFileDialog,
-                             QTableWidget, QTableWidgetItem, QHeaderView, QTabWidget,
+                             QListWidget, QTextEdit, QPlainTextEdit, QLabel, QLineEdit, QPushButton, 
+                             QComboBox, QSpinBox, QCheckBox, QSplitter, QMessageBox, QFileDialog,
+                             QTableView, QTableWidget, QTableWidgetItem, QHeaderView, QTabWidget,
                              QInputDialog, QGroupBox, QFormLayout, QMenu, QAbstractItemView)
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QSize, QPoint
-from PyQt6.QtGui import QPixmap, QAction, QIcon, QFont, QColor, QPainter
-from PIL import Image
+from PyQt6.QtCore import (Qt, QThread, QTimer, QObject, QUrl, QAbstractTableModel, QModelIndex,
+                          pyqtSignal, QSize, QSizeF, QPoint, QPointF, QRectF)
+from PyQt6.QtGui import QPixmap, QImage, QImageReader, QAction, QIcon, QFont, QColor, QPainter
 
+import metrics
+import pipeline
+import postprocess
 import utils
+from history_store import HistoryStore
+from job_store import JobStore
+from key_pool import KeyPool
+from thumbnails import ThumbnailCache
 
 # ================= Configuration =================
-HISTORY_FILE = "history.json"
+HISTORY_FILE = "history.db"
+# Older formats, imported into the database on first start
+LEGACY_HISTORY_FILES = ["history.jsonl", "history.json"]
+HISTORY_PAGE_SIZE = 200
+# Checkpointed generation jobs, resumed after a crash
+JOBS_FILE = "jobs.db"
 PROMPTS_FILE = "prompts.json"
 OUTPUT_DIR = "outputs"
-DEFAULT_MODELS = [
-        "Playground-v2.5",
-        "StableDiffusionXL",
-        "DALL-E-3",
-        "Nano-Banana-Pro",
-        "Qwen-Image",
-        "Flux-Pro"
-    ]
+THUMBNAIL_DIR = os.path.join(OUTPUT_DIR, ".thumbnails")
+PREVIEW_CACHE_BYTES = 256 * 1024 * 1024
+# Log panel: keeps the last LOG_MAX_LINES lines and repaints at most once per
+# LOG_FLUSH_MS. The full log goes to LOG_FILE (rotated); None disables it.
+LOG_MAX_LINES = 2000
+LOG_FLUSH_MS = 200
+LOG_FILE = os.path.join("logs", "poe_studio.log")
+LOG_FILE_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
+# `python gui.py --measure-startup` prints startup timings as JSON and exits
+MEASURE_STARTUP = "--measure-startup" in sys.argv
+# Prometheus text file, rewritten while the METRICS tab refreshes
+METRICS_FILE = metrics.METRICS_FILE
+METRICS_REFRESH_MS = 2000
+DEFAULT_MODELS = utils.DEFAULT_MODELS
 
 # Sci-Fi / Tech Theme Stylesheet
 TECH_STYLESHEET = """
@@ -52,7 +79,7 @@ QGroupBox::title {
     color: #82b1ff;
     font-weight: bold;
 }
-QListWidget, QTableWidget, QTextEdit {
+QListWidget, QTableView, QTextEdit, QPlainTextEdit {
     background-color: #2b2b36;
     border: 1px solid #444;
     border-radius: 4px;
@@ -61,16 +88,16 @@ QListWidget, QTableWidget, QTextEdit {
     selection-color: #ffffff;
     gridline-color: #444;
 }
-QListWidget::item:hover, QTableWidget::item:hover {
+QListWidget::item:hover, QTableView::item:hover {
     background-color: #323242;
 }
-QTableWidget::item:selected {
+QTableView::item:selected {
     background-color: #3f51b5;
     color: white;
     border: none;
     outline: none;
 }
-QTableWidget::item:focus {
+QTableView::item:focus {
     border: none;
     outline: none;
     background-color: #3f51b5;
@@ -138,16 +165,29 @@ QSplitter::handle {
 
 # ================= Custom Widgets =================
 class ImageLabel(QLabel):
+    # Zoomed past the decoded resolution; the owner should supply a sharper pixmap
+    resolution_needed = pyqtSignal(QSize)
+
     def __init__(self, text=""):
         super().__init__(text)
         self.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.file_path = None
+        self.source_size = QSize()
         self.original_pixmap = None
-        self.scaled_pixmap = None
+        self.mipmaps = []  # original, 1/2, 1/4, ... built on demand
         self.scale_factor = 1.0
         self.offset = QPoint(0, 0)
         self.last_mouse_pos = QPoint(0, 0)
         self.is_panning = False
         
+        # Fast (nearest) transforms while zooming/panning, then one smooth
+        # repaint once the interaction settles
+        self.fast_render = False
+        self.settle_timer = QTimer(self)
+        self.settle_timer.setSingleShot(True)
+        self.settle_timer.setInterval(150)
+        self.settle_timer.timeout.connect(self.finish_interaction)
+        
         self.setStyleSheet("""
             border: 2px dashed #444; 
             background-color: #1a1a20; 
@@ -157,19 +197,34 @@ class ImageLabel(QLabel):
         """)
         self.setMouseTracking(True)
         
-    def set_image(self, file_path):
-        if file_path and os.path.exists(file_path):
-            self.original_pixmap = QPixmap(file_path)
-            self.setText("")
-            self.reset_view()
-            return True
-        else:
-            self.clear_image()
-            return False
+    def set_pixmap(self, file_path, pixmap, source_size):
+        """
+        Show an already decoded pixmap. `source_size` is the full resolution
+        of the file, which may be larger than the decoded pixmap.
+        """
+        self.file_path = file_path
+        self.source_size = QSize(source_size)
+        self.original_pixmap = pixmap
+        self.mipmaps = [pixmap]
+        self.setText("")
+        self.reset_view()
+
+    def replace_pixmap(self, pixmap):
+        """
+        Swap in a higher-resolution decode of the same image, keeping the
+        current zoom and pan.
+        """
+        if self.original_pixmap and not pixmap.isNull():
+            self.scale_factor *= self.original_pixmap.width() / pixmap.width()
+        self.original_pixmap = pixmap
+        self.mipmaps = [pixmap]
+        self.update_display()
 
     def clear_image(self):
+        self.file_path = None
+        self.source_size = QSize()
         self.original_pixmap = None
-        self.scaled_pixmap = None
+        self.mipmaps = []
         self.setText("NO SIGNAL")
         self.update()
 
@@ -190,16 +245,39 @@ class ImageLabel(QLabel):
             self.update_display()
 
     def update_display(self):
-        if self.original_pixmap:
-            new_size = self.original_pixmap.size() * self.scale_factor
-            if not new_size.isEmpty():
-                self.scaled_pixmap = self.original_pixmap.scaled(
-                    new_size, 
-                    Qt.AspectRatioMode.KeepAspectRatio, 
-                    Qt.TransformationMode.SmoothTransformation
-                )
+        # Nothing is pre-scaled: paintEvent transforms only the visible region
         self.update()
-            
+
+    def begin_interaction(self):
+        self.fast_render = True
+        self.settle_timer.start()
+
+    def finish_interaction(self):
+        if self.is_panning:
+            self.settle_timer.start()
+            return
+        self.fast_render = False
+        self.update()
+
+    def mipmap_for_scale(self, scale):
+        """
+        Pick the smallest pyramid level that is still at least `scale` of the
+        original, so heavy downscaling starts from a pre-halved image.
+        Returns (pixmap, level_scale).
+        """
+        level, level_scale = 0, 1.0
+        while scale <= level_scale / 2 and self.mipmaps[level].width() > 64:
+            level += 1
+            level_scale /= 2
+            if level == len(self.mipmaps):
+                prev = self.mipmaps[level - 1]
+                self.mipmaps.append(prev.scaled(
+                    prev.size() / 2,
+                    Qt.AspectRatioMode.KeepAspectRatio,
+                    Qt.TransformationMode.SmoothTransformation
+                ))
+        return self.mipmaps[level], level_scale
+
     def resizeEvent(self, event):
         # We don't auto-resize the image box, but if the window is resized, 
         # we might want to re-fit? Actually the user said "image box don't auto change with image".
@@ -211,12 +289,31 @@ class ImageLabel(QLabel):
         # Draw background and text (if any)
         super().paintEvent(event)
         
-        if self.original_pixmap and self.scaled_pixmap:
+        if self.original_pixmap:
+            # Where the whole image would sit on screen: centered + offset
+            image_size = QSizeF(self.original_pixmap.size()) * self.scale_factor
+            top_left = QPointF(
+                (self.width() - image_size.width()) / 2 + self.offset.x(),
+                (self.height() - image_size.height()) / 2 + self.offset.y()
+            )
+            target = QRectF(top_left, image_size).intersected(QRectF(self.rect()))
+            if target.isEmpty():
+                return
+            
+            # Map the visible part back to source pixels, so the cost and
+            # memory are bounded by the viewport rather than the zoom level
+            pixmap, level_scale = self.mipmap_for_scale(self.scale_factor)
+            ratio = self.scale_factor / level_scale
+            source = QRectF(
+                (target.x() - top_left.x()) / ratio,
+                (target.y() - top_left.y()) / ratio,
+                target.width() / ratio,
+                target.height() / ratio
+            )
+            
             painter = QPainter(self)
-            # Calculate center position + offset
-            rect = self.scaled_pixmap.rect()
-            center_pos = self.rect().center() - rect.center() + self.offset
-            painter.drawPixmap(center_pos, self.scaled_pixmap)
+            painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, not self.fast_render)
+            painter.drawPixmap(target, pixmap, source)
 
     def wheelEvent(self, event):
         if self.original_pixmap:
@@ -230,11 +327,17 @@ class ImageLabel(QLabel):
             
             # Limit scale
             self.scale_factor = max(0.01, min(self.scale_factor, 50.0))
+            self.begin_interaction()
             self.update_display()
+            
+            # Past 1:1 on a reduced decode -> ask for the full resolution
+            if self.scale_factor > 1.0 and self.original_pixmap.width() < self.source_size.width():
+                self.resolution_needed.emit(self.source_size)
 
     def mousePressEvent(self, event):
         if event.button() == Qt.MouseButton.LeftButton:
             self.is_panning = True
+            self.begin_interaction()
             self.last_mouse_pos = event.pos()
             self.setCursor(Qt.CursorShape.ClosedHandCursor)
         elif event.button() == Qt.MouseButton.MiddleButton:
@@ -255,20 +358,324 @@ class ImageLabel(QLabel):
             self.setCursor(Qt.CursorShape.ArrowCursor)
         super().mouseReleaseEvent(event)
 
+class PixmapCache:
+    """
+    LRU cache of decoded pixmaps, bounded by their total size in bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()  # key -> (value, nbytes)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, nbytes):
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)[1]
+        self.entries[key] = (value, nbytes)
+        self.total_bytes += nbytes
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            _, (_, evicted_bytes) = self.entries.popitem(last=False)
+            self.total_bytes -= evicted_bytes
+
+class PreviewLoader(QObject):
+    """
+    Decodes preview images on a background pool at the size the viewport
+    needs (QImageReader.setScaledSize), caching the results in a PixmapCache.
+
+    Only the most recent request is delivered: older requests that have not
+    started decoding yet are skipped, and finished ones are cached but not
+    shown, so clicking quickly through rows never queues up stale work.
+    """
+    loaded = pyqtSignal(str, QPixmap, QSize)   # file_path, pixmap, full source size
+    failed = pyqtSignal(str)
+    decoded = pyqtSignal(int, object, QImage, QSize)  # internal: pool thread -> GUI thread
+
+    def __init__(self, max_bytes=PREVIEW_CACHE_BYTES, workers=2):
+        super().__init__()
+        self.cache = PixmapCache(max_bytes)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.current_id = 0
+        self.decoded.connect(self.on_decoded)
+
+    def request(self, file_path, target_size):
+        self.current_id += 1
+        try:
+            mtime = os.stat(file_path).st_mtime_ns
+        except OSError:
+            self.failed.emit(file_path)
+            return
+        
+        key = (file_path, mtime, target_size.width(), target_size.height())
+        cached = self.cache.get(key)
+        if cached:
+            self.loaded.emit(file_path, *cached)
+            return
+        self.executor.submit(self.decode, self.current_id, key, QSize(target_size))
+
+    def decode(self, request_id, key, target_size):
+        # Runs on the pool thread; QImage (unlike QPixmap) is safe to use here
+        if request_id != self.current_id:
+            return
+        reader = QImageReader(key[0])
+        source_size = reader.size()
+        if source_size.isValid() and not target_size.isEmpty():
+            scaled = source_size.scaled(target_size, Qt.AspectRatioMode.KeepAspectRatio)
+            if scaled.width() < source_size.width():
+                reader.setScaledSize(scaled)
+        image = reader.read()
+        if image.isNull() and request_id != self.current_id:
+            return
+        self.decoded.emit(request_id, key, image, source_size)
+
+    def on_decoded(self, request_id, key, image, source_size):
+        file_path = key[0]
+        if image.isNull():
+            if request_id == self.current_id:
+                self.failed.emit(file_path)
+            return
+        
+        pixmap = QPixmap.fromImage(image)
+        self.cache.put(key, (pixmap, source_size), image.sizeInBytes())
+        if request_id == self.current_id:
+            self.loaded.emit(file_path, pixmap, source_size)
+
+class ThumbnailService(QObject):
+    """
+    Generates thumbnails on a small background pool and reports back on the
+    GUI thread through `ready(file_path, thumbnail_path)`.
+    """
+    ready = pyqtSignal(str, str)
+    finished = pyqtSignal(str, str)  # internal: pool thread -> GUI thread
+
+    def __init__(self, cache, workers=2):
+        super().__init__()
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending = set()
+        self.failed = set()
+        self.finished.connect(self.on_finished)
+
+    def request(self, file_path):
+        if not file_path or file_path in self.pending or file_path in self.failed:
+            return
+        self.pending.add(file_path)
+        future = self.executor.submit(self.cache.generate, file_path)
+        future.add_done_callback(lambda f, path=file_path: self.report(path, f))
+
+    def report(self, file_path, future):
+        # Runs on the pool thread; the signal hops back to the GUI thread
+        try:
+            thumb_path = future.result() or ""
+        except Exception:
+            thumb_path = ""
+        self.finished.emit(file_path, thumb_path)
+
+    def on_finished(self, file_path, thumb_path):
+        self.pending.discard(file_path)
+        if thumb_path:
+            self.ready.emit(file_path, thumb_path)
+        else:
+            self.failed.add(file_path)
+
+class HistoryTableModel(QAbstractTableModel):
+    """
+    Lazy table model over HistoryStore. Rows are fetched a page at a time as
+    the view scrolls (canFetchMore/fetchMore) and cell values are built only
+    when the view asks for them, so cost does not grow with history size.
+    """
+    HEADERS = ["TIME", "MODEL", "PROMPT", "FILE"]
+    ICON_CACHE_SIZE = 500
+
+    def __init__(self, store, thumbnails=None, page_size=HISTORY_PAGE_SIZE):
+        super().__init__()
+        self.store = store
+        self.thumbnails = thumbnails
+        self.page_size = page_size
+        self.filters = {}
+        self.records = []
+        self.total = 0
+        self.icons = OrderedDict()  # file_path -> QIcon, LRU
+        if thumbnails:
+            thumbnails.ready.connect(self.on_thumbnail_ready)
+
+    def set_store(self, store):
+        self.store = store
+
+    def set_filters(self, filters):
+        self.beginResetModel()
+        self.filters = filters
+        if self.store is None:
+            # History still loading; the first search after set_store fills in
+            self.total, self.records = 0, []
+        else:
+            self.total = self.store.count(**filters)
+            self.records = self.store.query(limit=self.page_size, offset=0, **filters)
+        self.endResetModel()
+
+    def has_filters(self):
+        return any(self.filters.values())
+
+    def record(self, row):
+        if 0 <= row < len(self.records):
+            return self.records[row]
+        return None
+
+    def prepend(self, record):
+        self.beginInsertRows(QModelIndex(), 0, 0)
+        self.records.insert(0, record)
+        self.total += 1
+        self.endInsertRows()
+
+    def remove_row(self, row):
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.records[row]
+        self.total -= 1
+        self.endRemoveRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.records)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and len(self.records) < self.total
+
+    def fetchMore(self, parent):
+        if parent.isValid():
+            return
+        rows = self.store.query(limit=self.page_size, offset=len(self.records), **self.filters)
+        if not rows:
+            self.total = len(self.records)
+            return
+        start = len(self.records)
+        self.beginInsertRows(QModelIndex(), start, start + len(rows) - 1)
+        self.records.extend(rows)
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        item = self.records[index.row()]
+        column = index.column()
+        
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column == 0:
+                return item.get("timestamp", "")
+            if column == 1:
+                return item.get("model", "")
+            if column == 2:
+                # Truncate for display
+                full_prompt = item.get("prompt", "")
+                return (full_prompt[:50] + '...') if len(full_prompt) > 50 else full_prompt
+            if column == 3:
+                return os.path.basename(item.get("file_path", ""))
+        elif role == Qt.ItemDataRole.ToolTipRole and column == 2:
+            return item.get("prompt", "") # Show full prompt on hover
+        elif role == Qt.ItemDataRole.DecorationRole and column == 3:
+            return self.thumbnail_icon(item.get("file_path", ""))
+        elif role == Qt.ItemDataRole.ToolTipRole and column == 3:
+            # Hover preview from the thumbnail cache, never the full image
+            thumb_path = self.thumbnails.cache.get(item.get("file_path", "")) if self.thumbnails else None
+            if thumb_path:
+                return f'<img src="{QUrl.fromLocalFile(os.path.abspath(thumb_path)).toString()}">'
+            return item.get("file_path", "")
+        return None
+
+    def thumbnail_icon(self, file_path):
+        if not self.thumbnails or not file_path:
+            return None
+        if file_path in self.icons:
+            self.icons.move_to_end(file_path)
+            return self.icons[file_path]
+        
+        thumb_path = self.thumbnails.cache.get(file_path)
+        if not thumb_path:
+            # Backfill lazily; on_thumbnail_ready repaints the cell
+            self.thumbnails.request(file_path)
+            return None
+        
+        icon = QIcon(thumb_path)
+        self.icons[file_path] = icon
+        if len(self.icons) > self.ICON_CACHE_SIZE:
+            self.icons.popitem(last=False)
+        return icon
+
+    def on_thumbnail_ready(self, file_path, thumb_path):
+        self.icons.pop(file_path, None)
+        for row, item in enumerate(self.records):
+            if item.get("file_path") == file_path:
+                index = self.index(row, 3)
+                self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return None
+
 # ================= Worker Thread =================
 class GenerationWorker(QThread):
     progress_signal = pyqtSignal(str)  # Log message
     result_signal = pyqtSignal(dict)   # Result data {status, file_path, ...}
+    stats_signal = pyqtSignal(dict)    # Running counts {requested, saved, failed}
     finished_signal = pyqtSignal()
 
-    def __init__(self, api_key, model, prompt, batch_size, output_prefix):
+    def __init__(self, key_pool, model, prompt, batch_size, output_prefix, concurrency=1,
+                 download_workers=2, queue_limit=None, stream=False, job_store=None, job_id=None,
+                 items=None, postprocess_settings=None):
         super().__init__()
-        self.api_key = api_key
+        self.key_pool = key_pool
         self.model = model
         self.prompt = prompt
         self.batch_size = batch_size
         self.output_prefix = output_prefix
+        self.concurrency = max(1, concurrency)
+        self.download_workers = max(1, download_workers)
+        # Max URLs waiting for a downloader before producers block
+        self.queue_limit = queue_limit or self.download_workers * 2
+        self.stream = stream
+        # Optional re-encode/downscale of each saved image (see postprocess.py)
+        self.postprocess_settings = postprocess_settings
+        # Checkpoints each item in the job store; `items` (from
+        # JobStore.resumable_items) limits a resumed job to what is unfinished
+        self.job_store = job_store
+        self.job_id = job_id
+        self.items = items if items is not None else [{"seq": i} for i in range(batch_size)]
+        self.stats = {"requested": 0, "saved": 0, "failed": 0}
+        self.stats_lock = threading.Lock()
+        # Downloads whose result has not been counted yet (post-processing
+        # may still be running); run() waits for zero before finishing
+        self.outstanding = 0
+        self.settled = threading.Condition()
         self.is_running = True
+        self.stop_event = threading.Event()  # interrupts rate-limit waits and retry backoff on ABORT
+        self.pipeline = pipeline.Pipeline(key_pool, stream=stream, job_store=job_store,
+                                          on_log=self.progress_signal.emit, wait=self.stop_event.wait)
+
+    def task(self, item):
+        """
+        The pipeline task for one job item.
+        """
+        task = {"model": self.model, "prompt": self.prompt,
+                "output_file": os.path.join(OUTPUT_DIR, f"{self.output_prefix}.png"),
+                "postprocess": self.postprocess_settings}
+        task.update(item)
+        if self.job_id is not None:
+            task["job_id"] = self.job_id
+        return task
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+            stats = dict(self.stats)
+        self.stats_signal.emit(stats)
 
     def run(self):
         try:
@@ -276,71 +683,273 @@ class GenerationWorker(QThread):
             if not os.path.exists(OUTPUT_DIR):
                 os.makedirs(OUTPUT_DIR)
                 
-            # Set a longer timeout for image generation (e.g. 5 minutes)
-            client = utils.create_client(self.api_key, timeout=300)
-            self.progress_signal.emit(f"🚀 Starting generation batch (Total: {self.batch_size})...")
+            workers = max(1, min(self.concurrency, len(self.items)))
+            downloaders = max(1, min(self.download_workers, len(self.items)))
+            # One pooled connection per parallel download
+            utils.configure_downloads(pool_size=max(downloaders, utils.DOWNLOAD_POOL_SIZE))
+            self.progress_signal.emit(
+                f"🚀 Starting generation batch (Total: {self.batch_size}, Remaining: {len(self.items)}, "
+                f"API: {workers}, Downloads: {downloaders}, Keys: {len(self.key_pool)})..."
+            )
             
-            for i in range(self.batch_size):
-                if not self.is_running:
-                    break
-                
-                self.progress_signal.emit(f"Generating image {i+1}/{self.batch_size}...")
-                
-                try:
-                    # Create full path: outputs/prefix_1.png
-                    base_filename = os.path.join(OUTPUT_DIR, f"{self.output_prefix}.png")
-                    output_file = utils.get_unique_filename(base_filename)
-                    
-                    response = client.chat.completions.create(
-                        model=self.model,
-                        messages=[{"role": "user", "content": self.prompt}],
-                        stream=False
-                    )
-                    
-                    content = response.choices[0].message.content
-                    image_url = utils.get_image_url(content)
-                    
-                    if image_url:
-                        self.progress_signal.emit(f"⬇️ Image URL found. Downloading...")
-                        success = utils.download_image(image_url, output_file)
-                        if success:
-                            self.progress_signal.emit(f"✅ Success: Saved to {output_file}")
-                            self.result_signal.emit({
-                                "status": "success",
-                                "file_path": output_file,
-                                "model": self.model,
-                                "prompt": self.prompt,
-                                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                            })
-                        else:
-                            self.progress_signal.emit(f"❌ Error: Failed to download image.")
-                    else:
-                        # Check for known error messages from Poe
-                        lower_content = content.lower()
-                        if "timeout" in lower_content or "network" in lower_content:
-                            self.progress_signal.emit(f"⚠️ Poe Server Timeout: The model took too long to respond.")
-                            self.progress_signal.emit(f"👉 Suggestion: Try again or switch to a faster model.")
-                        else:
-                            self.progress_signal.emit(f"⚠️ Error: No image URL found in response.")
-                        
-                        # Log partial content for debugging
-                        preview_len = 200
-                        clean_content = content.replace('\n', ' ')[:preview_len]
-                        self.progress_signal.emit(f"🔍 Response Content: {clean_content}...")
+            # Stage 1 (producers) issue API requests and push image URLs onto a
+            # bounded queue; stage 2 (consumers) download them. A full queue
+            # blocks the producers, which keeps the two stages in step.
+            url_queue = queue.Queue(maxsize=self.queue_limit)
+            consumers = [
+                threading.Thread(target=self.download_loop, args=(url_queue,), daemon=True)
+                for _ in range(downloaders)
+            ]
+            for consumer in consumers:
+                consumer.start()
+            
+            try:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = {executor.submit(self.request_one, self.task(item), url_queue): item["seq"]
+                               for item in self.items}
+                    for future in as_completed(futures):
+                        if not self.is_running:
+                            for pending in futures:
+                                pending.cancel()
+                        if future.cancelled():
+                            continue
                         
-                except Exception as e:
-                    self.progress_signal.emit(f"❌ Error in task {i+1}: {str(e)}")
+                        i = futures[future]
+                        try:
+                            future.result()
+                        except Exception as e:
+                            self.progress_signal.emit(f"❌ Error in task {i+1}: {str(e)}")
+            finally:
+                # One sentinel per consumer; they drain everything queued before it
+                for _ in consumers:
+                    url_queue.put(None)
+                for consumer in consumers:
+                    consumer.join()
+                with self.settled:
+                    self.settled.wait_for(lambda: self.outstanding == 0)
                 
         except Exception as e:
             self.progress_signal.emit(f"🔥 Critical Error: {str(e)}")
         
         self.finished_signal.emit()
 
+    def request_one(self, task, url_queue):
+        """
+        Producer stage: request one reply and queue every image URL in it
+        for download as soon as it is known.
+        """
+        if not self.is_running:
+            return
+        
+        i = task["seq"]
+        request = pipeline.new_request(task)
+        started = time.monotonic()
+        if task.get("urls"):
+            self.progress_signal.emit(f"Resuming downloads for image {i+1}/{self.batch_size}...")
+        else:
+            self.progress_signal.emit(f"Generating image {i+1}/{self.batch_size}...")
+        
+        def queue_url(index, image_url):
+            url_queue.put((task, request, index, image_url, started))
+        
+        urls, error = self.pipeline.request(task, queue_url)
+        self.count("requested")
+        if not urls:
+            self.count("failed")
+
+    def download_loop(self, url_queue):
+        """
+        Consumer stage: download queued URLs until a None sentinel arrives.
+        Images that were already generated are still downloaded after ABORT,
+        since their points have been spent.
+        """
+        while True:
+            item = url_queue.get()
+            if item is None:
+                break
+            task = item[0]
+            try:
+                # Returns once the file is saved; post-processing finishes
+                # on the process pool while this thread takes the next URL
+                future = self.pipeline.download(*item)
+            except Exception as e:
+                self.progress_signal.emit(f"❌ Error in task {task['seq']+1}: {str(e)}")
+                continue
+            with self.settled:
+                self.outstanding += 1
+            future.add_done_callback(lambda future, task=task: self.downloaded(task, future))
+
+    def downloaded(self, task, future):
+        """
+        Count and publish one finished download. Runs on a download thread
+        or the post-processing pool's callback thread.
+        """
+        try:
+            result = future.result()
+            if result["status"] == "success":
+                self.count("saved")
+                self.result_signal.emit(result)
+            else:
+                self.count("failed")
+        except Exception as e:
+            self.progress_signal.emit(f"❌ Error in task {task['seq']+1}: {str(e)}")
+        finally:
+            # Only now is this image reflected in the stats run() reports
+            with self.settled:
+                self.outstanding -= 1
+                self.settled.notify_all()
+
     def stop(self):
         self.is_running = False
+        self.stop_event.set()
+
+# ================= Job Queue =================
+class QueuedJob:
+    """
+    One generation batch in the scheduler's queue.
+    `items` is None for a fresh job, or the unfinished items of a resumed one.
+    """
+    QUEUED, RUNNING, DONE, CANCELLED = "Queued", "Running", "Done", "Cancelled"
+
+    def __init__(self, job_id, settings, api_keys, items=None):
+        self.job_id = job_id
+        self.settings = settings
+        self.api_keys = api_keys
+        self.items = items
+        self.total = len(items) if items is not None else settings["batch_size"]
+        self.state = self.QUEUED
+        self.worker = None
+        self.stats = {"requested": 0, "saved": 0, "failed": 0}
+
+    @property
+    def label(self):
+        return self.settings["output_prefix"]
+
+    def finished(self):
+        return self.state in (self.DONE, self.CANCELLED)
+
+class JobScheduler(QObject):
+    """
+    Runs queued generation jobs, up to `max_running` at a time, in queue
+    order. Every job shares the window's KeyPool (and so its API clients
+    and their connections), the process-wide download session, the rate
+    limiter and the circuit breakers.
+    """
+    changed = pyqtSignal()           # queue contents, order, state or progress
+    log = pyqtSignal(str)
+    result = pyqtSignal(dict)
+    idle = pyqtSignal()              # nothing running or queued anymore
+
+    def __init__(self, job_store, key_pool_for, max_running=2):
+        super().__init__()
+        self.job_store = job_store
+        self.key_pool_for = key_pool_for  # api_keys -> KeyPool
+        self.max_running = max_running
+        self.jobs = []
+
+    def enqueue(self, job):
+        self.jobs.append(job)
+        self.changed.emit()
+        self.schedule()
+
+    def set_max_running(self, max_running):
+        self.max_running = max(1, max_running)
+        self.schedule()
+
+    def running(self):
+        return [job for job in self.jobs if job.state == QueuedJob.RUNNING]
+
+    def active(self):
+        return [job for job in self.jobs if not job.finished()]
+
+    def move(self, job, offset):
+        """
+        Move a job up (offset < 0) or down the queue; queue order decides
+        which queued job starts next.
+        """
+        row = self.jobs.index(job)
+        target = max(0, min(len(self.jobs) - 1, row + offset))
+        if target != row:
+            self.jobs.insert(target, self.jobs.pop(row))
+            self.changed.emit()
+
+    def cancel(self, job):
+        if job.finished():
+            return
+        # A cancelled job is never offered for resume
+        self.job_store.finish_job(job.job_id, "cancelled")
+        if job.worker is not None:
+            job.worker.stop()
+            self.log.emit(f"System: Cancelling job '{job.label}' (finishing downloads in flight)...")
+        job.state = QueuedJob.CANCELLED
+        self.changed.emit()
+        self.check_idle()
+
+    def cancel_all(self):
+        for job in list(self.jobs):
+            self.cancel(job)
+
+    def clear_finished(self):
+        # Cancelled jobs stay listed until their worker has wound down
+        self.jobs = [job for job in self.jobs if not job.finished() or
+                     (job.worker is not None and job.worker.isRunning())]
+        self.changed.emit()
+
+    def schedule(self):
+        running = len(self.running())
+        for job in self.jobs:
+            if running >= self.max_running:
+                break
+            if job.state == QueuedJob.QUEUED:
+                self.start(job)
+                running += 1
+
+    def start(self, job):
+        settings = job.settings
+        worker = GenerationWorker(
+            self.key_pool_for(job.api_keys), settings["model"], settings["prompt"], settings["batch_size"],
+            settings["output_prefix"], settings.get("concurrency", 1), settings.get("download_workers", 2),
+            stream=settings.get("stream", False), job_store=self.job_store, job_id=job.job_id,
+            items=job.items, postprocess_settings=settings.get("postprocess")
+        )
+        # Downloads from every running job share one keep-alive pool
+        utils.configure_downloads(pool_size=max(utils.DOWNLOAD_POOL_SIZE, sum(
+            other.settings.get("download_workers", 2) for other in self.running()
+        ) + worker.download_workers))
+        job.worker = worker
+        job.state = QueuedJob.RUNNING
+        worker.progress_signal.connect(lambda message, job=job: self.log.emit(f"[{job.label}] {message}"))
+        worker.result_signal.connect(self.result)
+        worker.stats_signal.connect(lambda stats, job=job: self.on_stats(job, stats))
+        worker.finished_signal.connect(lambda job=job: self.on_finished(job))
+        self.log.emit(f"System: Starting job '{job.label}' on {settings['model']} ({job.total} image(s))...")
+        worker.start()
+        self.changed.emit()
+
+    def on_stats(self, job, stats):
+        job.stats = stats
+        self.changed.emit()
+
+    def on_finished(self, job):
+        if job.state == QueuedJob.RUNNING:
+            job.state = QueuedJob.DONE
+            self.log.emit(f"System: Job '{job.label}' completed ({job.stats['saved']} saved).")
+        # finished_signal is the last thing run() does; let the thread exit
+        # before dropping the QThread
+        job.worker.wait()
+        job.worker = None
+        self.changed.emit()
+        self.schedule()
+        self.check_idle()
+
+    def check_idle(self):
+        if not self.active() and not any(job.worker is not None for job in self.jobs):
+            self.idle.emit()
 
 # ================= Main Window =================
 class PoeImageStudio(QMainWindow):
+    history_prepared = pyqtSignal(object)  # None, or the exception that stopped it
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Poe Image Studio")
@@ -349,12 +958,21 @@ class PoeImageStudio(QMainWindow):
         
         # Data
         self.prompts = []
-        self.history = []
+        self.key_pool = None
+        self.history_store = None   # opened in the background, see start_history_load
+        self.pending_history = []   # results that arrived before it was ready
+        self.first_paint_ms = None
+        self.history_ready_ms = None
+        self.setup_logging()
         self.load_data()
         
         # UI Components
         self.init_ui()
         
+        # Heavy work waits until the window is up
+        self.history_prepared.connect(self.on_history_prepared)
+        QTimer.singleShot(0, self.start_history_load)
+        
     def init_ui(self):
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -430,7 +1048,54 @@ class PoeImageStudio(QMainWindow):
         self.batch_spin = QSpinBox()
         self.batch_spin.setRange(1, 10)
         self.batch_spin.setValue(1)
-        form_layout.addRow("Batch Quantity:", self.batch_spin)
+        
+        self.concurrency_spin = QSpinBox()
+        self.concurrency_spin.setRange(1, 10)
+        self.concurrency_spin.setValue(2)
+        self.concurrency_spin.setToolTip("Number of API requests in flight at once")
+        
+        batch_layout = QHBoxLayout()
+        batch_layout.addWidget(self.batch_spin, 1)
+        batch_layout.addWidget(QLabel("Parallel:"))
+        batch_layout.addWidget(self.concurrency_spin, 1)
+        form_layout.addRow("Batch Quantity:", batch_layout)
+        
+        self.download_spin = QSpinBox()
+        self.download_spin.setRange(1, 10)
+        self.download_spin.setValue(2)
+        self.download_spin.setToolTip("Number of parallel image downloads")
+        form_layout.addRow("Download Workers:", self.download_spin)
+        
+        self.jobs_spin = QSpinBox()
+        self.jobs_spin.setRange(1, 5)
+        self.jobs_spin.setValue(self.scheduler.max_running)
+        self.jobs_spin.setToolTip("Queued jobs that run at the same time (they share one connection pool)")
+        self.jobs_spin.valueChanged.connect(self.scheduler.set_max_running)
+        form_layout.addRow("Parallel Jobs:", self.jobs_spin)
+        
+        self.stream_check = QCheckBox("Start downloads while the reply is still streaming")
+        self.stream_check.setChecked(True)
+        form_layout.addRow("Streaming:", self.stream_check)
+        
+        self.postprocess_combo = QComboBox()
+        self.postprocess_combo.addItem("Off", None)
+        self.postprocess_combo.addItem("WebP", "webp")
+        self.postprocess_combo.addItem("AVIF", "avif")
+        self.postprocess_combo.addItem("Optimized PNG", "png")
+        self.postprocess_combo.setToolTip("Re-encode each image after download (runs on a background process pool)")
+        self.max_size_spin = QSpinBox()
+        self.max_size_spin.setRange(0, 8192)
+        self.max_size_spin.setSingleStep(256)
+        self.max_size_spin.setSpecialValueText("Original")
+        self.max_size_spin.setToolTip("Downscale so the longest side is at most this many pixels")
+        self.strip_check = QCheckBox("Strip metadata")
+        self.strip_check.setChecked(True)
+        postprocess_layout = QHBoxLayout()
+        postprocess_layout.addWidget(self.postprocess_combo, 1)
+        postprocess_layout.addWidget(QLabel("Max Size:"))
+        postprocess_layout.addWidget(self.max_size_spin, 1)
+        postprocess_layout.addWidget(self.strip_check)
+        form_layout.addRow("Post-process:", postprocess_layout)
         
         self.filename_edit = QLineEdit("image")
         self.filename_edit.setPlaceholderText("e.g. cyberpunk_city")
@@ -442,7 +1107,7 @@ class PoeImageStudio(QMainWindow):
         # API Key Config
         api_layout = QHBoxLayout()
         self.api_key_edit = QLineEdit()
-        self.api_key_edit.setPlaceholderText("POE_API_KEY (Leave empty to use .env)")
+        self.api_key_edit.setPlaceholderText("POE_API_KEY, or several separated by commas (Leave empty to use .env)")
         self.api_key_edit.setEchoMode(QLineEdit.EchoMode.Password)
         api_layout.addWidget(QLabel("API Key:"))
         api_layout.addWidget(self.api_key_edit)
@@ -452,12 +1117,12 @@ class PoeImageStudio(QMainWindow):
 
         # Actions
         action_layout = QHBoxLayout()
-        self.btn_generate = QPushButton("INITIATE GENERATION")
+        self.btn_generate = QPushButton("ADD TO QUEUE")
         self.btn_generate.setFixedHeight(45)
         self.btn_generate.setStyleSheet("background-color: #3f51b5; font-size: 14px; letter-spacing: 1px;")
         self.btn_generate.clicked.connect(self.start_generation)
         
-        self.btn_stop = QPushButton("ABORT")
+        self.btn_stop = QPushButton("ABORT ALL")
         self.btn_stop.setFixedHeight(45)
         self.btn_stop.setStyleSheet("background-color: #b71c1c; font-size: 14px;")
         self.btn_stop.setEnabled(False)
@@ -467,10 +1132,33 @@ class PoeImageStudio(QMainWindow):
         action_layout.addWidget(self.btn_stop, 1)
         mid_layout.addLayout(action_layout)
         
+        # Job Queue
+        mid_layout.addWidget(QLabel("JOB QUEUE:"))
+        self.job_table = QTableWidget(0, 4)
+        self.job_table.setHorizontalHeaderLabels(["JOB", "MODEL", "PROGRESS", "STATUS"])
+        self.job_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.job_table.verticalHeader().setVisible(False)
+        self.job_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.job_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.job_table.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.job_table.setShowGrid(False)
+        self.job_table.setMaximumHeight(130)
+        mid_layout.addWidget(self.job_table)
+        
+        job_buttons = QHBoxLayout()
+        for label, handler in [("▲", lambda: self.move_selected_job(-1)), ("▼", lambda: self.move_selected_job(1)),
+                               ("CANCEL", self.cancel_selected_job), ("CLEAR DONE", self.scheduler.clear_finished)]:
+            button = QPushButton(label)
+            button.setStyleSheet("background-color: #2b2b36; border: 1px solid #555;")
+            button.clicked.connect(handler)
+            job_buttons.addWidget(button)
+        mid_layout.addLayout(job_buttons)
+        
         # Logs
         mid_layout.addWidget(QLabel("SYSTEM LOGS:"))
-        self.log_output = QTextEdit()
+        self.log_output = QPlainTextEdit()
         self.log_output.setReadOnly(True)
+        self.log_output.setMaximumBlockCount(LOG_MAX_LINES)  # oldest lines drop off
         self.log_output.setMaximumHeight(120)
         self.log_output.setStyleSheet("font-family: Consolas, monospace; font-size: 12px; color: #81c784;")
         mid_layout.addWidget(self.log_output)
@@ -489,31 +1177,96 @@ class PoeImageStudio(QMainWindow):
         history_widget = QWidget()
         h_layout = QVBoxLayout(history_widget)
         h_layout.setContentsMargins(0, 0, 0, 0)
-        self.history_table = QTableWidget()
-        self.history_table.setColumnCount(4)
-        self.history_table.setHorizontalHeaderLabels(["TIME", "MODEL", "PROMPT", "FILE"])
-        self.history_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
-        # Give PROMPT column more space if possible, or keep all stretch
-        # Let's make PROMPT stretch more than others? 
-        # For simplicity, keep all stretch for now, user can resize if interactive, but ResizeMode.Stretch makes it fixed ratio.
-        # Maybe set specific modes: Time (Fixed/ResizeToContents), Model (ResizeToContents), Prompt (Stretch), File (ResizeToContents)
+        
+        # Search / filter bar
+        search_layout = QHBoxLayout()
+        self.history_search_edit = QLineEdit()
+        self.history_search_edit.setPlaceholderText("Search prompts...")
+        self.history_search_edit.setClearButtonEnabled(True)
+        search_layout.addWidget(self.history_search_edit, 3)
+        
+        self.history_file_edit = QLineEdit()
+        self.history_file_edit.setPlaceholderText("Filename...")
+        self.history_file_edit.setClearButtonEnabled(True)
+        search_layout.addWidget(self.history_file_edit, 1)
+        
+        self.history_model_combo = QComboBox()
+        self.history_model_combo.addItem("All Models", None)
+        search_layout.addWidget(self.history_model_combo)
+        
+        self.history_range_combo = QComboBox()
+        for label, days in [("Any Time", None), ("Last 24 Hours", 1), ("Last 7 Days", 7), ("Last 30 Days", 30)]:
+            self.history_range_combo.addItem(label, days)
+        search_layout.addWidget(self.history_range_combo)
+        h_layout.addLayout(search_layout)
+        
+        # Debounce typing so each keystroke doesn't hit the database
+        self.history_search_timer = QTimer(self)
+        self.history_search_timer.setSingleShot(True)
+        self.history_search_timer.setInterval(250)
+        self.history_search_timer.timeout.connect(self.search_history)
+        self.history_search_edit.textChanged.connect(self.history_search_timer.start)
+        self.history_file_edit.textChanged.connect(self.history_search_timer.start)
+        self.history_model_combo.currentIndexChanged.connect(self.search_history)
+        self.history_range_combo.currentIndexChanged.connect(self.search_history)
+        
+        self.history_model = HistoryTableModel(self.history_store, self.thumbnails)
+        self.history_table = QTableView()
+        self.history_table.setModel(self.history_model)
+        self.history_table.setIconSize(QSize(24, 24))
+        # Fixed widths instead of ResizeToContents, which would measure rows
         header = self.history_table.horizontalHeader()
-        header.setSectionResizeMode(0, QHeaderView.ResizeMode.ResizeToContents) # Time
-        header.setSectionResizeMode(1, QHeaderView.ResizeMode.ResizeToContents) # Model
-        header.setSectionResizeMode(2, QHeaderView.ResizeMode.Stretch)          # Prompt
-        header.setSectionResizeMode(3, QHeaderView.ResizeMode.ResizeToContents) # File
+        header.setSectionResizeMode(0, QHeaderView.ResizeMode.Interactive)     # Time
+        header.setSectionResizeMode(1, QHeaderView.ResizeMode.Interactive)     # Model
+        header.setSectionResizeMode(2, QHeaderView.ResizeMode.Stretch)         # Prompt
+        header.setSectionResizeMode(3, QHeaderView.ResizeMode.Interactive)     # File
+        header.resizeSection(0, 140)
+        header.resizeSection(1, 130)
+        header.resizeSection(3, 150)
         
-        self.history_table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        self.history_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
         self.history_table.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
         self.history_table.setShowGrid(False)
         self.history_table.verticalHeader().setVisible(False)
+        self.history_table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
         self.history_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
         self.history_table.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         self.history_table.customContextMenuRequested.connect(self.show_history_context_menu)
-        self.history_table.itemSelectionChanged.connect(self.on_history_selection_changed)
+        self.history_table.selectionModel().selectionChanged.connect(self.on_history_selection_changed)
         h_layout.addWidget(self.history_table)
+        
+        self.history_count_label = QLabel("")
+        h_layout.addWidget(self.history_count_label)
         tabs.addTab(history_widget, "HISTORY")
         
+        # Metrics Tab
+        metrics_widget = QWidget()
+        m_layout = QVBoxLayout(metrics_widget)
+        m_layout.setContentsMargins(0, 0, 0, 0)
+        
+        self.metrics_summary_table = self.create_metrics_table(
+            ["Model", "Requests", "Success", "Images", "Img/min", "MB/s", "p50", "p95", "p99"]
+        )
+        m_layout.addWidget(self.metrics_summary_table, 1)
+        self.metrics_stage_table = self.create_metrics_table(
+            ["Model", "Stage", "Count", "Mean", "p50", "p95", "p99"]
+        )
+        m_layout.addWidget(self.metrics_stage_table, 2)
+        
+        metrics_footer = QHBoxLayout()
+        metrics_footer.addWidget(QLabel(f"Latency in seconds (p50/p95/p99 per image). Also written to {METRICS_FILE}"))
+        metrics_footer.addStretch()
+        btn_reset_metrics = QPushButton("RESET")
+        btn_reset_metrics.clicked.connect(self.reset_metrics)
+        metrics_footer.addWidget(btn_reset_metrics)
+        m_layout.addLayout(metrics_footer)
+        tabs.addTab(metrics_widget, "METRICS")
+        
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.setInterval(METRICS_REFRESH_MS)
+        self.metrics_timer.timeout.connect(self.refresh_metrics)
+        self.metrics_timer.start()
+        
         right_layout.addWidget(tabs)
         
         # Preview Area
@@ -539,6 +1292,11 @@ class PoeImageStudio(QMainWindow):
 
         self.preview_label = ImageLabel("NO SIGNAL")
         self.preview_label.setMinimumHeight(350)
+        self.preview_label.resolution_needed.connect(self.load_full_resolution)
+        
+        self.preview_loader = PreviewLoader()
+        self.preview_loader.loaded.connect(self.on_preview_loaded)
+        self.preview_loader.failed.connect(self.on_preview_failed)
         right_layout.addWidget(self.preview_label)
         
         self.btn_open_file = QPushButton("OPEN FILE LOCATION")
@@ -553,7 +1311,6 @@ class PoeImageStudio(QMainWindow):
         splitter.setSizes([250, 500, 450])
         
         self.update_prompt_list()
-        self.update_history_table()
 
     # ================= Data Management =================
     def load_data(self):
@@ -564,21 +1321,81 @@ class PoeImageStudio(QMainWindow):
                     self.prompts = json.load(f)
             except:
                 self.prompts = []
+        self.saved_prompts = json.dumps(self.prompts, ensure_ascii=False)
         
-        # Load History
-        if os.path.exists(HISTORY_FILE):
+        # History opens after the window is shown (start_history_load)
+        self.thumbnails = ThumbnailService(ThumbnailCache(THUMBNAIL_DIR))
+        
+        # Open the job queue, dropping jobs that have nothing left to run
+        self.job_store = JobStore(JOBS_FILE).open()
+        self.job_store.purge()
+        
+        self.scheduler = JobScheduler(self.job_store, self.get_key_pool)
+        self.scheduler.log.connect(self.log)
+        self.scheduler.result.connect(self.handle_generation_result)
+        self.scheduler.changed.connect(self.update_job_table)
+        self.scheduler.idle.connect(self.generation_finished)
+
+    def start_history_load(self):
+        """
+        Prepare the history database off the GUI thread: schema, FTS index
+        and, on first run, importing history.jsonl / history.json can take a
+        while. The table then pages records in as it scrolls.
+        """
+        def prepare():
             try:
-                with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
-                    self.history = json.load(f)
-            except:
-                self.history = []
+                HistoryStore(HISTORY_FILE, LEGACY_HISTORY_FILES).open().close()
+                # Leftovers of downloads a crash interrupted
+                utils.sweep_partials(OUTPUT_DIR)
+                # Also pays PIL's import cost here rather than on first paint
+                self.thumbnails.cache.detect_format()
+                self.history_prepared.emit(None)
+            except Exception as e:
+                self.history_prepared.emit(e)
+        
+        threading.Thread(target=prepare, daemon=True).start()
+
+    def on_history_prepared(self, error):
+        if error is not None:
+            self.log(f"System: Could not open history: {error}")
+            if MEASURE_STARTUP:
+                QApplication.instance().exit(1)
+            return
+        # Quick now that the schema exists; the connection stays on this thread
+        self.history_store = HistoryStore(HISTORY_FILE).open()
+        self.history_model.set_store(self.history_store)
+        for result in self.pending_history:
+            self.history_store.append(result)
+        self.pending_history = []
+        self.refresh_history_models()
+        self.search_history()
+        
+        self.history_ready_ms = (time.perf_counter() - STARTUP_STARTED) * 1000
+        self.log(f"System: History ready ({self.history_ready_ms:.0f} ms after launch).")
+        self.finish_startup_measurement()
 
-    def save_data(self):
+    def report_startup(self):
+        self.first_paint_ms = (time.perf_counter() - STARTUP_STARTED) * 1000
+        self.log(f"System: Window ready in {self.first_paint_ms:.0f} ms.")
+        if MEASURE_STARTUP:
+            self.finish_startup_measurement()
+        else:
+            self.offer_resume()
+
+    def finish_startup_measurement(self):
+        if MEASURE_STARTUP and self.first_paint_ms is not None and self.history_ready_ms is not None:
+            print(json.dumps({"first_paint_ms": round(self.first_paint_ms, 1),
+                              "history_ready_ms": round(self.history_ready_ms, 1)}), flush=True)
+            QApplication.instance().quit()
+
+    def save_prompts(self):
+        # Only rewrite prompts.json when the library actually changed
+        snapshot = json.dumps(self.prompts, ensure_ascii=False)
+        if snapshot == self.saved_prompts:
+            return
         with open(PROMPTS_FILE, 'w', encoding='utf-8') as f:
             json.dump(self.prompts, f, indent=4, ensure_ascii=False)
-            
-        with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-            json.dump(self.history, f, indent=4, ensure_ascii=False)
+        self.saved_prompts = snapshot
 
     # ================= Prompt Logic =================
     def update_prompt_list(self):
@@ -614,7 +1431,7 @@ class PoeImageStudio(QMainWindow):
         else:
             self.prompts.append({"title": title, "content": content})
             
-        self.save_data()
+        self.save_prompts()
         self.update_prompt_list()
         self.log(f"System: Prompt '{title}' saved to library.")
 
@@ -629,17 +1446,69 @@ class PoeImageStudio(QMainWindow):
         
         if confirm == QMessageBox.StandardButton.Yes:
             del self.prompts[idx]
-            self.save_data()
+            self.save_prompts()
             self.update_prompt_list()
             self.new_prompt()
 
     # ================= Generation Logic =================
+    def setup_logging(self):
+        """
+        Buffer log lines for the panel (flushed by log_timer) and mirror them
+        to a rotating log file, written by a background listener thread.
+        """
+        self.log_buffer = []
+        self.log_timer = QTimer(self)
+        self.log_timer.setInterval(LOG_FLUSH_MS)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.log_timer.start()
+        
+        self.file_logger = None
+        self.log_listener = None
+        if not LOG_FILE:
+            return
+        try:
+            os.makedirs(os.path.dirname(LOG_FILE) or ".", exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                LOG_FILE, maxBytes=LOG_FILE_BYTES, backupCount=LOG_FILE_BACKUPS, encoding="utf-8"
+            )
+        except OSError as e:
+            self.log(f"System: Log file disabled ({e})")
+            return
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        log_queue = queue.SimpleQueue()
+        self.log_listener = logging.handlers.QueueListener(log_queue, handler)
+        self.log_listener.start()
+        self.file_logger = logging.getLogger("poe_studio")
+        self.file_logger.setLevel(logging.INFO)
+        self.file_logger.propagate = False
+        self.file_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
     def log(self, message):
         timestamp = datetime.now().strftime("[%H:%M:%S]")
-        self.log_output.append(f"{timestamp} {message}")
-        # Scroll to bottom
+        self.log_buffer.append(f"{timestamp} {message}")
+        if self.file_logger is not None:
+            self.file_logger.info(message)
+
+    def flush_log(self):
+        if not self.log_buffer:
+            return
+        # Only what the panel can hold; older lines are in the log file
+        lines = self.log_buffer[-LOG_MAX_LINES:]
+        self.log_buffer = []
         sb = self.log_output.verticalScrollBar()
-        sb.setValue(sb.maximum())
+        # Follow new output unless the user scrolled up to read
+        at_bottom = sb.value() >= sb.maximum() - 4
+        self.log_output.appendPlainText("\n".join(lines))
+        if at_bottom:
+            sb.setValue(sb.maximum())
+
+    def closeEvent(self, event):
+        self.flush_log()
+        if self.log_listener is not None:
+            self.log_listener.stop()
+            self.log_listener = None
+        postprocess.shutdown()
+        super().closeEvent(event)
 
     def start_generation(self):
         prompt = self.prompt_text_edit.toPlainText().strip()
@@ -649,89 +1518,226 @@ class PoeImageStudio(QMainWindow):
 
         model = self.model_combo.currentText()
         batch_size = self.batch_spin.value()
+        stream = self.stream_check.isChecked()
         prefix = self.filename_edit.text().strip() or "image"
         
-        # Get API Key
-        api_key = self.api_key_edit.text().strip()
-        if not api_key:
-            api_key = os.getenv("POE_API_KEY")
-        
-        if not api_key:
+        # Get API Keys (several keys are pooled for throughput)
+        api_keys = utils.get_api_keys(self.api_key_edit.text())
+        if not api_keys:
             QMessageBox.critical(self, "Error", "API Key is missing. Please set it in .env or the text box.")
             return
 
-        self.btn_generate.setEnabled(False)
+        # Checkpoint the batch so it can be resumed after a crash
+        settings = {"model": model, "prompt": prompt, "batch_size": batch_size,
+                    "output_prefix": prefix, "stream": stream,
+                    "concurrency": self.concurrency_spin.value(),
+                    "download_workers": self.download_spin.value(),
+                    "postprocess": {"format": self.postprocess_combo.currentData(),
+                                    "max_dimension": self.max_size_spin.value(),
+                                    "strip_metadata": self.strip_check.isChecked()}}
+        base_filename = os.path.join(OUTPUT_DIR, f"{prefix}.png")
+        items = [{"model": model, "prompt": prompt, "output_file": base_filename} for _ in range(batch_size)]
+        job_id = self.job_store.create_job(items, source="gui", settings=settings)
+
+        self.log(f"System: Queued job '{prefix}' ({model} x{batch_size}).")
+        self.btn_stop.setEnabled(True)
+        self.scheduler.enqueue(QueuedJob(job_id, settings, api_keys))
+
+    def offer_resume(self):
+        jobs = self.job_store.unfinished_jobs("gui")
+        if not jobs:
+            return
+        remaining = sum(job["remaining"] for job in jobs)
+        confirm = QMessageBox.question(
+            self, "Resume",
+            f"{len(jobs)} generation job(s) did not finish last time ({remaining} image(s) remaining).\n"
+            "Resume them now?",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+        )
+        if confirm != QMessageBox.StandardButton.Yes:
+            for job in jobs:
+                self.job_store.finish_job(job["id"], "cancelled")
+            return
+        
+        api_keys = utils.get_api_keys(self.api_key_edit.text())
+        if not api_keys:
+            self.log("System: API Key is missing; unfinished jobs will be offered again next start.")
+            return
         self.btn_stop.setEnabled(True)
-        self.log("System: Initializing generation sequence...")
+        for job in jobs:
+            self.log(f"System: Resuming job '{job['settings']['output_prefix']}' "
+                     f"({job['remaining']}/{job['total']} remaining)...")
+            self.scheduler.enqueue(QueuedJob(job["id"], job["settings"], api_keys,
+                                             self.job_store.resumable_items(job["id"])))
 
-        self.worker = GenerationWorker(api_key, model, prompt, batch_size, prefix)
-        self.worker.progress_signal.connect(self.log)
-        self.worker.result_signal.connect(self.handle_generation_result)
-        self.worker.finished_signal.connect(self.generation_finished)
-        self.worker.start()
+    def get_key_pool(self, api_keys):
+        # Reuse the pool (and its clients' connections) while the keys are unchanged
+        if self.key_pool is None or [k.api_key for k in self.key_pool.keys] != list(dict.fromkeys(api_keys)):
+            # Set a longer timeout for image generation (e.g. 5 minutes)
+            self.key_pool = KeyPool(api_keys, timeout=300)
+        return self.key_pool
 
     def stop_generation(self):
-        if hasattr(self, 'worker') and self.worker.isRunning():
-            self.worker.stop()
-            self.log("System: Aborting sequence...")
+        if self.scheduler.active():
+            self.scheduler.cancel_all()
+            self.log("System: Aborting all jobs...")
             self.btn_stop.setEnabled(False)
 
     def generation_finished(self):
-        self.btn_generate.setEnabled(True)
         self.btn_stop.setEnabled(False)
-        self.log("System: Sequence completed.")
+        self.log("System: Queue completed.")
+
+    def selected_job(self):
+        rows = self.job_table.selectionModel().selectedRows()
+        if rows and rows[0].row() < len(self.scheduler.jobs):
+            return self.scheduler.jobs[rows[0].row()]
+        return None
+
+    def move_selected_job(self, offset):
+        job = self.selected_job()
+        if job:
+            self.scheduler.move(job, offset)
+            self.job_table.selectRow(self.scheduler.jobs.index(job))
+
+    def cancel_selected_job(self):
+        job = self.selected_job()
+        if job:
+            self.scheduler.cancel(job)
+
+    def update_job_table(self):
+        jobs = self.scheduler.jobs
+        self.job_table.setRowCount(len(jobs))
+        for row, job in enumerate(jobs):
+            stats = job.stats
+            progress = f"{stats['requested']}/{job.total} requested, {stats['saved']} saved"
+            if stats["failed"]:
+                progress += f", {stats['failed']} failed"
+            for column, text in enumerate([job.label, job.settings["model"], progress, job.state]):
+                item = self.job_table.item(row, column)
+                if item is None:
+                    self.job_table.setItem(row, column, QTableWidgetItem(text))
+                elif item.text() != text:
+                    item.setText(text)
+        if self.scheduler.active():
+            self.btn_stop.setEnabled(True)
 
     def handle_generation_result(self, result):
         if result["status"] == "success":
-            self.history.insert(0, result) # Add to top
-            self.save_data()
-            self.update_history_table()
+            if self.history_store is None:
+                self.pending_history.append(result)
+            else:
+                self.history_store.append(result)
+            self.thumbnails.request(result["file_path"])
+            if self.history_model_combo.findData(result["model"]) < 0:
+                self.history_model_combo.addItem(result["model"], result["model"])
+            # Incremental insert at the top; filtered views are left alone
+            # since the new record may not match the search.
+            if not self.history_model.has_filters():
+                self.history_model.prepend(result)
+                self.update_history_count()
             # Auto preview latest
             self.show_preview(result["file_path"])
 
+    # ================= Metrics =================
+    def create_metrics_table(self, headers):
+        table = QTableWidget(0, len(headers))
+        table.setHorizontalHeaderLabels(headers)
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.ResizeToContents)
+        table.verticalHeader().setVisible(False)
+        table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        table.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        table.setShowGrid(False)
+        return table
+
+    def fill_metrics_table(self, table, rows):
+        table.setRowCount(len(rows))
+        for r, row in enumerate(rows):
+            for c, value in enumerate(row):
+                item = QTableWidgetItem(value)
+                if c > 0:
+                    item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                table.setItem(r, c, item)
+
+    def refresh_metrics(self):
+        snapshot = metrics.METRICS.snapshot()
+        if snapshot == getattr(self, 'metrics_snapshot', None):
+            return
+        self.metrics_snapshot = snapshot
+        
+        summary_rows, stage_rows = [], []
+        for model, data in sorted(snapshot.items()):
+            total = data["stages"].get(metrics.TOTAL, {})
+            summary_rows.append([
+                model,
+                str(data["requests"]),
+                f"{data['success_rate']:.0%}",
+                f"{data['images']}/{data['images'] + data['failed_images']}",
+                f"{data['images_per_minute']:.1f}",
+                f"{data['download_bytes_per_second'] / 1e6:.2f}",
+                f"{total.get('p50', 0):.1f}",
+                f"{total.get('p95', 0):.1f}",
+                f"{total.get('p99', 0):.1f}",
+            ])
+            for stage in metrics.STAGES:
+                stats = data["stages"].get(stage)
+                if stats is None:
+                    continue
+                stage_rows.append([model, stage, str(stats["count"])] + [
+                    f"{stats[key]:.3f}" for key in ("mean", "p50", "p95", "p99")
+                ])
+        self.fill_metrics_table(self.metrics_summary_table, summary_rows)
+        self.fill_metrics_table(self.metrics_stage_table, stage_rows)
+        
+        if snapshot:
+            try:
+                metrics.METRICS.write_prometheus(METRICS_FILE)
+            except OSError as e:
+                self.log(f"System: Could not write {METRICS_FILE}: {e}")
+
+    def reset_metrics(self):
+        metrics.METRICS.reset()
+        self.refresh_metrics()
+
     # ================= History & Preview =================
-    def update_history_table(self):
-        self.history_table.setRowCount(len(self.history))
-        for i, item in enumerate(self.history):
-            # Time
-            time_item = QTableWidgetItem(item.get("timestamp", ""))
-            time_item.setFlags(time_item.flags() & ~Qt.ItemFlag.ItemIsEditable)
-            self.history_table.setItem(i, 0, time_item)
-            
-            # Model
-            model_item = QTableWidgetItem(item.get("model", ""))
-            model_item.setFlags(model_item.flags() & ~Qt.ItemFlag.ItemIsEditable)
-            self.history_table.setItem(i, 1, model_item)
-
-            # Prompt (Truncated)
-            full_prompt = item.get("prompt", "")
-            # Truncate for display
-            display_prompt = (full_prompt[:50] + '...') if len(full_prompt) > 50 else full_prompt
-            prompt_item = QTableWidgetItem(display_prompt)
-            prompt_item.setToolTip(full_prompt) # Show full prompt on hover
-            prompt_item.setFlags(prompt_item.flags() & ~Qt.ItemFlag.ItemIsEditable)
-            self.history_table.setItem(i, 2, prompt_item)
-            
-            # File
-            file_item = QTableWidgetItem(os.path.basename(item.get("file_path", "")))
-            file_item.setFlags(file_item.flags() & ~Qt.ItemFlag.ItemIsEditable)
-            self.history_table.setItem(i, 3, file_item)
+    def history_filters(self):
+        filters = {
+            "text": self.history_search_edit.text().strip() or None,
+            "filename": self.history_file_edit.text().strip() or None,
+            "model": self.history_model_combo.currentData(),
+        }
+        days = self.history_range_combo.currentData()
+        if days:
+            filters["since"] = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+        return filters
+
+    def refresh_history_models(self):
+        if self.history_store is None:
+            return
+        for model in self.history_store.models():
+            if self.history_model_combo.findData(model) < 0:
+                self.history_model_combo.addItem(model, model)
+
+    def search_history(self):
+        self.history_model.set_filters(self.history_filters())
+        self.update_history_count()
+
+    def update_history_count(self):
+        self.history_count_label.setText(f"{self.history_model.total} records")
 
     def on_history_selection_changed(self):
-        selected_items = self.history_table.selectedItems()
-        if selected_items:
-            # We get multiple items per row, just take the first one's row
-            row = self.history_table.row(selected_items[0])
-            self.load_history_preview_by_row(row)
+        rows = self.history_table.selectionModel().selectedRows()
+        if rows:
+            self.load_history_preview_by_row(rows[0].row())
 
     def load_history_preview_by_row(self, row):
-        if 0 <= row < len(self.history):
-            file_path = self.history[row].get("file_path", "")
-            self.show_preview(file_path)
+        record = self.history_model.record(row)
+        if record:
+            self.show_preview(record.get("file_path", ""))
 
     def show_history_context_menu(self, pos):
-        item = self.history_table.itemAt(pos)
-        if not item:
+        index = self.history_table.indexAt(pos)
+        if not index.isValid():
             return
             
         menu = QMenu()
@@ -741,13 +1747,13 @@ class PoeImageStudio(QMainWindow):
         action = menu.exec(self.history_table.mapToGlobal(pos))
         
         if action:
-            row = self.history_table.row(item)
+            row = index.row()
             delete_file = (action == delete_file_action)
             self.delete_history_item(row, delete_file)
 
     def delete_history_item(self, row, delete_file):
-        if 0 <= row < len(self.history):
-            item_data = self.history[row]
+        item_data = self.history_model.record(row)
+        if item_data:
             file_path = item_data.get("file_path", "")
             
             # Confirm
@@ -767,22 +1773,43 @@ class PoeImageStudio(QMainWindow):
                         QMessageBox.warning(self, "Error", f"Failed to delete file: {e}")
                 
                 # Remove from data
-                del self.history[row]
-                self.save_data()
-                self.update_history_table()
+                self.history_store.remove(item_data)
+                self.history_model.remove_row(row)
+                self.update_history_count()
                 
                 # Clear preview if it was showing this item
                 if hasattr(self, 'current_preview_path') and self.current_preview_path == file_path:
-                    self.preview_label.set_image("") # Resets to missing/empty
-                    self.btn_open_file.setEnabled(False)
+                    self.clear_preview()
 
     def show_preview(self, file_path):
-        if self.preview_label.set_image(file_path):
+        if file_path and os.path.exists(file_path):
             self.current_preview_path = file_path
             self.btn_open_file.setEnabled(True)
+            # Decoded in the background; on_preview_loaded shows it with a
+            # fresh view (file_path is only kept for full-resolution upgrades)
+            self.preview_label.file_path = None
+            self.preview_loader.request(file_path, self.preview_label.size())
         else:
+            self.preview_label.clear_image()
             self.btn_open_file.setEnabled(False)
 
+    def on_preview_loaded(self, file_path, pixmap, source_size):
+        if file_path != getattr(self, 'current_preview_path', None):
+            return
+        if self.preview_label.file_path == file_path:
+            self.preview_label.replace_pixmap(pixmap)
+        else:
+            self.preview_label.set_pixmap(file_path, pixmap, source_size)
+
+    def on_preview_failed(self, file_path):
+        if file_path == getattr(self, 'current_preview_path', None):
+            self.preview_label.clear_image()
+            self.btn_open_file.setEnabled(False)
+
+    def load_full_resolution(self, source_size):
+        if self.preview_label.file_path:
+            self.preview_loader.request(self.preview_label.file_path, source_size)
+
     def clear_preview(self):
         self.preview_label.clear_image()
         self.current_preview_path = None
@@ -807,4 +1834,6 @@ if __name__ == "__main__":
     
     window = PoeImageStudio()
     window.show()
+    # Runs once the event loop has painted the window
+    QTimer.singleShot(0, window.report_startup)
     sys.exit(app.exec())
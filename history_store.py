@@ -0,0 +1,201 @@
+import json
+import os
+import sqlite3
+import uuid
+
+# Columns stored directly; any other record keys go into the `extra` JSON blob
+COLUMNS = ("id", "timestamp", "model", "prompt", "file_path")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT UNIQUE NOT NULL,
+    timestamp TEXT NOT NULL DEFAULT '',
+    model TEXT NOT NULL DEFAULT '',
+    prompt TEXT NOT NULL DEFAULT '',
+    file_path TEXT NOT NULL DEFAULT '',
+    filename TEXT NOT NULL DEFAULT '',
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history(timestamp);
+CREATE INDEX IF NOT EXISTS idx_history_model ON history(model, seq);
+CREATE INDEX IF NOT EXISTS idx_history_filename ON history(filename);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+    prompt, content='history', content_rowid='seq'
+);
+CREATE TRIGGER IF NOT EXISTS history_fts_insert AFTER INSERT ON history BEGIN
+    INSERT INTO history_fts(rowid, prompt) VALUES (new.seq, new.prompt);
+END;
+CREATE TRIGGER IF NOT EXISTS history_fts_delete AFTER DELETE ON history BEGIN
+    INSERT INTO history_fts(history_fts, rowid, prompt) VALUES ('delete', old.seq, old.prompt);
+END;
+"""
+
+class HistoryStore:
+    """
+    SQLite-backed generation history.
+
+    Records are plain dicts ({id, timestamp, model, prompt, file_path, ...}).
+    Prompt text is indexed with FTS5 when the SQLite build supports it
+    (falling back to LIKE), and queries are paginated so the caller never
+    has to hold the whole history in memory.
+    """
+
+    def __init__(self, path, legacy_paths=()):
+        self.path = path
+        self.legacy_paths = legacy_paths
+        self.conn = None
+        self.fts = False
+
+    def open(self):
+        self.conn = sqlite3.connect(self.path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        try:
+            self.conn.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5
+            self.fts = False
+
+        if self.count() == 0:
+            for legacy_path in self.legacy_paths:
+                if os.path.exists(legacy_path):
+                    self.migrate_legacy(legacy_path)
+        return self
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    # ---------- Writes ----------
+    def append(self, record):
+        """
+        Persist a new record. Assigns it an `id` if it does not have one.
+        """
+        record.setdefault("id", uuid.uuid4().hex)
+        with self.conn:
+            self.insert(record)
+
+    def insert(self, record):
+        extra = {k: v for k, v in record.items() if k not in COLUMNS}
+        file_path = record.get("file_path") or ""
+        self.conn.execute(
+            "INSERT OR IGNORE INTO history (id, timestamp, model, prompt, file_path, filename, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (record["id"], record.get("timestamp") or "", record.get("model") or "",
+             record.get("prompt") or "", file_path, os.path.basename(file_path),
+             json.dumps(extra, ensure_ascii=False))
+        )
+
+    def remove(self, record):
+        with self.conn:
+            self.conn.execute("DELETE FROM history WHERE id = ?", (record.get("id"),))
+
+    # ---------- Reads ----------
+    def build_filters(self, text=None, model=None, since=None, until=None, filename=None):
+        """
+        Build the WHERE clause for a query. `since`/`until` are timestamp
+        strings ("YYYY-MM-DD[ HH:MM:SS]") and compare lexically.
+        """
+        clauses, params = [], []
+        if text and text.strip():
+            if self.fts:
+                clauses.append("seq IN (SELECT rowid FROM history_fts WHERE history_fts MATCH ?)")
+                params.append(fts_query(text))
+            else:
+                clauses.append("prompt LIKE ?")
+                params.append(f"%{text.strip()}%")
+        if model:
+            clauses.append("model = ?")
+            params.append(model)
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            clauses.append("timestamp <= ?")
+            params.append(until)
+        if filename:
+            clauses.append("filename LIKE ?")
+            params.append(f"%{filename}%")
+        where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+        return where, params
+
+    def query(self, limit=100, offset=0, **filters):
+        """
+        Return one page of matching records, newest first.
+        """
+        where, params = self.build_filters(**filters)
+        rows = self.conn.execute(
+            f"SELECT * FROM history{where} ORDER BY seq DESC LIMIT ? OFFSET ?",
+            params + [limit, offset]
+        ).fetchall()
+        return [row_to_record(row) for row in rows]
+
+    def count(self, **filters):
+        where, params = self.build_filters(**filters)
+        return self.conn.execute(f"SELECT COUNT(*) FROM history{where}", params).fetchone()[0]
+
+    def models(self):
+        rows = self.conn.execute("SELECT DISTINCT model FROM history ORDER BY model").fetchall()
+        return [row[0] for row in rows if row[0]]
+
+    # ---------- Migration ----------
+    def migrate_legacy(self, legacy_path):
+        """
+        Import history.json (a list, newest first) or the history.jsonl
+        append-only log, then keep the original as a .bak file.
+        """
+        try:
+            if legacy_path.endswith(".jsonl"):
+                records = read_jsonl_log(legacy_path)
+            else:
+                with open(legacy_path, 'r', encoding='utf-8') as f:
+                    records = list(reversed(json.load(f)))
+        except (OSError, ValueError):
+            return
+
+        with self.conn:
+            for record in records:
+                record.setdefault("id", uuid.uuid4().hex)
+                self.insert(record)
+        os.replace(legacy_path, legacy_path + ".bak")
+
+def row_to_record(row):
+    record = json.loads(row["extra"] or "{}")
+    for key in COLUMNS:
+        record[key] = row[key]
+    return record
+
+def fts_query(text):
+    """
+    Turn free text into an FTS5 query: every word must match as a prefix.
+    Words are quoted so FTS syntax characters in prompts are harmless.
+    """
+    terms = [word.replace('"', '""') for word in text.split()]
+    return " ".join(f'"{term}"*' for term in terms)
+
+def read_jsonl_log(path):
+    """
+    Replay an append-only history.jsonl log into its live records,
+    oldest first.
+    """
+    records = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("op") == "add":
+                record = entry.get("record", {})
+                records[record.get("id")] = record
+            elif entry.get("op") == "delete":
+                records.pop(entry.get("id"), None)
+    return list(records.values())
@@ -0,0 +1,225 @@
+import json
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+
+# Item states. An item is one generation request:
+#   pending   -> not requested yet (or interrupted before the reply arrived)
+#   requested -> the reply arrived; its image URLs are checkpointed
+#   downloaded / failed -> settled
+PENDING = "pending"
+REQUESTED = "requested"
+DOWNLOADED = "downloaded"
+FAILED = "failed"
+UNFINISHED = (PENDING, REQUESTED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    created TEXT NOT NULL DEFAULT '',
+    source TEXT NOT NULL DEFAULT '',
+    settings TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'active'
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    model TEXT NOT NULL DEFAULT '',
+    prompt TEXT NOT NULL DEFAULT '',
+    output_file TEXT NOT NULL DEFAULT '',
+    state TEXT NOT NULL DEFAULT 'pending',
+    urls TEXT NOT NULL DEFAULT '[]',
+    downloads TEXT NOT NULL DEFAULT '{}',
+    error TEXT NOT NULL DEFAULT '',
+    updated TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (job_id, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_job_items_state ON job_items(job_id, state);
+"""
+
+class JobStore:
+    """
+    Crash-safe on-disk queue of generation jobs.
+
+    A job is a list of items ({model, prompt, output_file}); each item is
+    checkpointed as it moves through pending -> requested -> downloaded or
+    failed, so after a crash only the unfinished items are run again. An
+    item that already has its image URLs only re-downloads the missing
+    images instead of spending points on a new request.
+
+    Safe to use from worker threads; writes are serialized on one
+    connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def open(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+        return self
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    # ---------- Jobs ----------
+    def create_job(self, items, source="", settings=None):
+        """
+        Persist a new job and return its id. Each item gets a `job_id` and
+        `seq` key so runners can checkpoint it.
+        """
+        job_id = uuid.uuid4().hex
+        now = timestamp()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO jobs (id, created, source, settings) VALUES (?, ?, ?, ?)",
+                (job_id, now, source, json.dumps(settings or {}, ensure_ascii=False))
+            )
+            for seq, item in enumerate(items):
+                item["job_id"], item["seq"] = job_id, seq
+                self.conn.execute(
+                    "INSERT INTO job_items (job_id, seq, model, prompt, output_file, updated) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (job_id, seq, item.get("model") or "", item.get("prompt") or "",
+                     item.get("output_file") or "", now)
+                )
+        return job_id
+
+    def unfinished_jobs(self, source=None):
+        """
+        Active jobs that still have pending or requested items, oldest first.
+        Each job dict carries `settings`, `remaining` and `total` counts.
+        """
+        sql = (
+            "SELECT jobs.*, "
+            "SUM(job_items.state IN ('pending', 'requested')) AS remaining, "
+            "COUNT(*) AS total "
+            "FROM jobs JOIN job_items ON job_items.job_id = jobs.id "
+            "WHERE jobs.status = 'active'"
+        )
+        params = []
+        if source:
+            sql += " AND jobs.source = ?"
+            params.append(source)
+        sql += " GROUP BY jobs.id HAVING remaining > 0 ORDER BY jobs.created"
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job["settings"] = json.loads(job["settings"] or "{}")
+            jobs.append(job)
+        return jobs
+
+    def resumable_items(self, job_id):
+        """
+        The job's unfinished items, in order, as task dicts. Requested
+        items carry their `urls` and the `downloads` already settled.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM job_items WHERE job_id = ? AND state IN ('pending', 'requested') "
+                "ORDER BY seq",
+                (job_id,)
+            ).fetchall()
+        return [row_to_item(row) for row in rows]
+
+    def finish_job(self, job_id, status="done"):
+        """
+        Close a job ("done" or "cancelled"); closed jobs are never resumed.
+        """
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE jobs SET status = ? WHERE id = ?", (status, job_id))
+
+    def purge(self):
+        """
+        Drop closed jobs and jobs with nothing left to run.
+        """
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM jobs WHERE status != 'active' OR id NOT IN "
+                "(SELECT job_id FROM job_items WHERE state IN ('pending', 'requested'))"
+            )
+
+    # ---------- Item checkpoints ----------
+    def mark_requested(self, job_id, seq, urls):
+        """
+        Record the image URLs of an item's reply.
+        """
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE job_items SET state = ?, urls = ?, updated = ? WHERE job_id = ? AND seq = ?",
+                (REQUESTED, json.dumps(list(urls)), timestamp(), job_id, seq)
+            )
+            self.settle(job_id, seq)
+
+    def mark_downloaded(self, job_id, seq, url, file_path):
+        """
+        Record the outcome of one image download (`file_path` None when it
+        failed). The item settles once every URL of its reply has one.
+        """
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT downloads FROM job_items WHERE job_id = ? AND seq = ?", (job_id, seq)
+            ).fetchone()
+            if row is None:
+                return
+            downloads = json.loads(row["downloads"])
+            downloads[url] = file_path
+            self.conn.execute(
+                "UPDATE job_items SET downloads = ?, updated = ? WHERE job_id = ? AND seq = ?",
+                (json.dumps(downloads), timestamp(), job_id, seq)
+            )
+            self.settle(job_id, seq)
+
+    def mark_failed(self, job_id, seq, error=""):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE job_items SET state = ?, error = ?, updated = ? WHERE job_id = ? AND seq = ?",
+                (FAILED, str(error), timestamp(), job_id, seq)
+            )
+
+    def settle(self, job_id, seq):
+        # Caller holds the lock and the transaction
+        row = self.conn.execute(
+            "SELECT state, urls, downloads FROM job_items WHERE job_id = ? AND seq = ?", (job_id, seq)
+        ).fetchone()
+        if row is None or row["state"] != REQUESTED:
+            return
+        urls, downloads = json.loads(row["urls"]), json.loads(row["downloads"])
+        if urls and all(url in downloads for url in urls):
+            state = DOWNLOADED if any(downloads[url] for url in urls) else FAILED
+            self.conn.execute(
+                "UPDATE job_items SET state = ? WHERE job_id = ? AND seq = ?", (state, job_id, seq)
+            )
+
+def row_to_item(row):
+    return {
+        "job_id": row["job_id"],
+        "seq": row["seq"],
+        "model": row["model"],
+        "prompt": row["prompt"],
+        "output_file": row["output_file"],
+        "state": row["state"],
+        "urls": json.loads(row["urls"]),
+        "downloads": json.loads(row["downloads"]),
+    }
+
+def pending_urls(task):
+    """
+    URLs of a resumed, already-requested item that still need downloading.
+    """
+    downloads = task.get("downloads") or {}
+    return [url for url in task.get("urls") or [] if url not in downloads]
+
+def timestamp():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
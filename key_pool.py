@@ -0,0 +1,135 @@
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import resilience
+import utils
+
+# How long a key sits out after different kinds of trouble (seconds)
+ERROR_COOLDOWN = 60
+QUOTA_COOLDOWN = 3600
+ERROR_THRESHOLD = 3   # consecutive errors before an error cooldown
+
+class PooledKey:
+    """
+    One API key with its own client (and so its own connection pool).
+    """
+
+    def __init__(self, api_key, timeout=None):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.in_flight = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.disabled = False
+        self._client = None
+        self._async_client = None
+
+    @property
+    def label(self):
+        return f"...{self.api_key[-4:]}"
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = utils.create_client(self.api_key, timeout=self.timeout)
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = utils.create_async_client(self.api_key, timeout=self.timeout)
+        return self._async_client
+
+    def healthy(self, now):
+        return not self.disabled and now >= self.cooldown_until
+
+class KeyPool:
+    """
+    Spreads requests across several Poe API keys.
+
+    Each request leases the least-loaded healthy key. Keys that run out of
+    quota, fail authentication or keep erroring are taken out of rotation
+    (temporarily or for good), so aggregate throughput scales with the
+    number of working keys.
+    """
+
+    def __init__(self, api_keys, timeout=None):
+        keys = list(dict.fromkeys(k for k in api_keys if k))
+        if not keys:
+            raise ValueError("No Poe API keys configured (POE_API_KEYS / POE_API_KEY).")
+        self.keys = [PooledKey(k, timeout) for k in keys]
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            healthy = [k for k in self.keys if k.healthy(now)]
+            if not healthy:
+                # Retryable: the backoff gives cooling keys time to come back.
+                # Says nothing about the model, so the breaker ignores it
+                raise resilience.GenerationError(
+                    resilience.KEYS_EXHAUSTED, "All API keys are cooling down or disabled."
+                )
+            key = min(healthy, key=lambda k: k.in_flight)
+            key.in_flight += 1
+            return key
+
+    def release(self, key, exc=None):
+        with self.lock:
+            key.in_flight -= 1
+            if exc is None:
+                key.failures = 0
+                return
+
+            status = getattr(exc, "status_code", None)
+            message = str(exc).lower()
+            openai = sys.modules.get("openai")  # see resilience.classify_exception
+            if openai is not None and isinstance(exc, (openai.AuthenticationError, openai.PermissionDeniedError)):
+                key.disabled = True
+            elif status == 402 or "quota" in message or "insufficient" in message:
+                key.cooldown_until = time.monotonic() + QUOTA_COOLDOWN
+            elif resilience.classify_exception(exc) == resilience.TRANSIENT_API:
+                # 429s are left to the rate limiter, which slows the key down
+                # instead of benching it
+                key.failures += 1
+                if key.failures >= ERROR_THRESHOLD:
+                    key.cooldown_until = time.monotonic() + ERROR_COOLDOWN
+                    key.failures = 0
+
+    @contextmanager
+    def lease(self):
+        """
+        with pool.lease() as key: ... key.client / key.async_client ...
+        The outcome of the block is reported back to the pool.
+        """
+        key = self.acquire()
+        try:
+            yield key
+        except Exception as exc:
+            # Bot replies without an image say nothing about the key itself
+            self.release(key, None if isinstance(exc, resilience.GenerationError) else exc)
+            raise
+        self.release(key)
+
+    def status(self):
+        now = time.monotonic()
+        with self.lock:
+            return [
+                {
+                    "key": k.label,
+                    "in_flight": k.in_flight,
+                    "state": "disabled" if k.disabled else ("cooling" if not k.healthy(now) else "ok"),
+                }
+                for k in self.keys
+            ]
+
+    async def aclose(self):
+        for key in self.keys:
+            if key._async_client is not None:
+                await key._async_client.close()
+                key._async_client = None
@@ -0,0 +1,226 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Pipeline stages, in order. For streamed replies EXTRACT also covers
+# receiving the reply, since URLs are found while it arrives. SAVE is the
+# job-store checkpoint that makes a downloaded image survive a crash.
+CLIENT = "client"
+REQUEST = "request"
+EXTRACT = "extract"
+DOWNLOAD = "download"
+POSTPROCESS = "postprocess"
+SAVE = "save"
+TOTAL = "total"
+STAGES = (CLIENT, REQUEST, EXTRACT, DOWNLOAD, POSTPROCESS, SAVE, TOTAL)
+
+QUANTILES = (0.5, 0.95, 0.99)
+# Latest samples kept per (model, stage) for the quantiles
+SAMPLE_LIMIT = 2048
+METRICS_FILE = "metrics.prom"
+
+class StageStats:
+    """
+    Count, sum and a bounded window of recent samples for one stage.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=SAMPLE_LIMIT)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.samples.append(seconds)
+
+    def quantiles(self):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in QUANTILES}
+
+class ModelStats:
+    def __init__(self, now):
+        self.first_seen = now
+        self.last_seen = now
+        self.requests = 0
+        self.failed_requests = 0
+        self.images = 0
+        self.failed_images = 0
+        self.download_bytes = 0
+        self.download_seconds = 0.0
+        self.stages = {}
+
+class Metrics:
+    """
+    Per-model timings for every pipeline stage plus request/image outcomes.
+    Thread-safe; snapshot() aggregates them into latency quantiles, success
+    rate, images per minute and download throughput.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.models = {}
+
+    def reset(self):
+        with self.lock:
+            self.models = {}
+
+    def model_stats(self, model):
+        # Caller holds the lock
+        now = time.monotonic()
+        stats = self.models.get(model)
+        if stats is None:
+            stats = self.models[model] = ModelStats(now)
+        stats.last_seen = now
+        return stats
+
+    def observe(self, model, stage, seconds):
+        with self.lock:
+            stats = self.model_stats(model)
+            stats.stages.setdefault(stage, StageStats()).add(seconds)
+
+    @contextmanager
+    def timer(self, model, stage):
+        """
+        Time the body as one sample of `stage`, whether or not it raises.
+        """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(model, stage, time.monotonic() - started)
+
+    def record_request(self, model, ok):
+        with self.lock:
+            stats = self.model_stats(model)
+            stats.requests += 1
+            if not ok:
+                stats.failed_requests += 1
+
+    def record_image(self, model, ok, seconds=None):
+        """
+        Count one image outcome; `seconds` is its end-to-end time.
+        """
+        with self.lock:
+            stats = self.model_stats(model)
+            stats.images += 1
+            if not ok:
+                stats.failed_images += 1
+            if seconds is not None:
+                stats.stages.setdefault(TOTAL, StageStats()).add(seconds)
+
+    def record_download(self, model, nbytes, seconds):
+        with self.lock:
+            stats = self.model_stats(model)
+            stats.download_bytes += nbytes
+            stats.download_seconds += seconds
+            stats.stages.setdefault(DOWNLOAD, StageStats()).add(seconds)
+
+    def snapshot(self):
+        """
+        Return {model: {...}} with counts, rates and per-stage
+        {count, mean, p50, p95, p99} in seconds.
+        """
+        with self.lock:
+            result = {}
+            for model, stats in self.models.items():
+                saved = stats.images - stats.failed_images
+                # At least a minute, so one fast image doesn't read as 1000/min
+                minutes = max(stats.last_seen - stats.first_seen, 60.0) / 60.0
+                stages = {}
+                for stage, stage_stats in stats.stages.items():
+                    quantiles = stage_stats.quantiles()
+                    stages[stage] = {
+                        "count": stage_stats.count,
+                        "sum": stage_stats.total,
+                        "mean": stage_stats.total / stage_stats.count,
+                        "p50": quantiles[0.5],
+                        "p95": quantiles[0.95],
+                        "p99": quantiles[0.99],
+                    }
+                result[model] = {
+                    "requests": stats.requests,
+                    "failed_requests": stats.failed_requests,
+                    "success_rate": 1 - stats.failed_requests / stats.requests if stats.requests else 0.0,
+                    "images": saved,
+                    "failed_images": stats.failed_images,
+                    "images_per_minute": saved / minutes,
+                    "download_bytes": stats.download_bytes,
+                    "download_bytes_per_second": (stats.download_bytes / stats.download_seconds
+                                                  if stats.download_seconds else 0.0),
+                    "stages": stages,
+                }
+            return result
+
+    def prometheus_text(self):
+        """
+        Render the snapshot in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP poe_stage_seconds Time spent in each generation stage.",
+            "# TYPE poe_stage_seconds summary",
+        ]
+        for model, data in sorted(snapshot.items()):
+            for stage in STAGES:
+                stage_data = data["stages"].get(stage)
+                if stage_data is None:
+                    continue
+                labels = f'model="{escape_label(model)}",stage="{stage}"'
+                for key, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+                    lines.append(f'poe_stage_seconds{{{labels},quantile="{q}"}} {stage_data[key]:.6f}')
+                lines.append(f"poe_stage_seconds_sum{{{labels}}} {stage_data['sum']:.6f}")
+                lines.append(f"poe_stage_seconds_count{{{labels}}} {stage_data['count']}")
+
+        counters = [
+            ("poe_requests_total", "counter", "Generation requests by outcome.",
+             lambda d: [("ok", d["requests"] - d["failed_requests"]), ("failed", d["failed_requests"])]),
+            ("poe_images_total", "counter", "Images by outcome.",
+             lambda d: [("ok", d["images"]), ("failed", d["failed_images"])]),
+        ]
+        for name, kind, help_text, values in counters:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for model, data in sorted(snapshot.items()):
+                for status, value in values(data):
+                    lines.append(f'{name}{{model="{escape_label(model)}",status="{status}"}} {value}')
+
+        gauges = [
+            ("poe_download_bytes_total", "counter", "Bytes downloaded.", "download_bytes"),
+            ("poe_images_per_minute", "gauge", "Saved images per minute.", "images_per_minute"),
+            ("poe_download_bytes_per_second", "gauge", "Average download throughput.",
+             "download_bytes_per_second"),
+            ("poe_request_success_ratio", "gauge", "Share of requests that produced images.", "success_rate"),
+        ]
+        for name, kind, help_text, key in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for model, data in sorted(snapshot.items()):
+                lines.append(f'{name}{{model="{escape_label(model)}"}} {data[key]:g}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path=METRICS_FILE):
+        """
+        Atomically (re)write the metrics file, e.g. for node_exporter's
+        textfile collector.
+        """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+# Shared by the GUI worker, the CLI and the async engine
+METRICS = Metrics()
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
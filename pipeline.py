@@ -0,0 +1,264 @@
+import time
+import uuid
+from concurrent.futures import CancelledError, Future
+from datetime import datetime
+
+import metrics
+import postprocess
+import rate_limit
+import resilience
+import utils
+from job_store import pending_urls
+
+# One generation item moves through: request -> extract URLs -> download
+# each image -> post-process -> checkpoint. Pipeline runs these steps on
+# threads for the GUI worker and the sequential CLI; async_engine is the
+# asyncio variant and shares the helpers below, so both record results,
+# checkpoints and metrics the same way.
+#
+# A task is a dict with `model`, `prompt` and `output_file` (the base
+# name; every image gets a unique name from it). Job items also carry
+# `job_id`/`seq`, and resumed ones their `urls`/`downloads` (see
+# job_store). An optional `postprocess` key holds postprocess settings.
+
+def label(task):
+    return f"{task['model']} #{task.get('seq', 0) + 1}"
+
+def new_request(task):
+    """
+    Fields shared by every result of one request; `request_id` links the
+    images of one reply in history.
+    """
+    return {"model": task["model"], "prompt": task["prompt"], "request_id": uuid.uuid4().hex}
+
+def image_result(request, index, file_path=None, error=None, started=None, **extra):
+    """
+    The result dict for one image (or, with index None, for a request
+    that produced none).
+    """
+    result = dict(request, status="failed" if error or not file_path else "success",
+                  file_path=file_path, timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"), **extra)
+    if index is not None:
+        result["image_index"] = index
+    if error:
+        result["error"] = error
+    if started is not None:
+        result["elapsed"] = time.monotonic() - started
+    return result
+
+def checkpoint_request(job_store, task, urls, error=None):
+    """
+    Record a finished request: its URLs, or the failure when it has none.
+    An item that was only held back (see resilience.UNSETTLED_KINDS) stays
+    pending, so --resume runs it again.
+    """
+    if job_store is None or "job_id" not in task or (not urls and error in resilience.UNSETTLED_KINDS):
+        return
+    if urls:
+        job_store.mark_requested(task["job_id"], task["seq"], urls)
+    else:
+        job_store.mark_failed(task["job_id"], task["seq"], error or "")
+
+def checkpoint_download(job_store, task, url, file_path):
+    """
+    Record one image outcome (`file_path` None when it failed). This is
+    the SAVE stage: the point after which the image survives a crash.
+    """
+    if job_store is None or "job_id" not in task:
+        return
+    with metrics.METRICS.timer(task["model"], metrics.SAVE):
+        job_store.mark_downloaded(task["job_id"], task["seq"], url, file_path)
+
+def log_request_failure(on_log, task, exc):
+    """
+    Log why a request produced no images; returns the error recorded for it.
+    """
+    name = label(task)
+    if isinstance(exc, resilience.CircuitOpenError):
+        on_log(f"⛔ [{name}] Stopped while waiting: {exc}")
+        return exc.kind
+    if not isinstance(exc, resilience.GenerationError):
+        on_log(f"❌ [{name}] Error: {exc}")
+        return str(exc)
+    if exc.kind == resilience.POE_TIMEOUT:
+        on_log(f"⚠️ [{name}] Poe Server Timeout: the model took too long to respond.")
+        on_log("👉 Suggestion: Try again or switch to a faster model.")
+    elif exc.kind == resilience.NO_URL:
+        on_log(f"⚠️ [{name}] No image URL found in response.")
+    else:
+        on_log(f"⚠️ [{name}] {exc}")
+    clean_content = (exc.content or "").replace('\n', ' ')[:200]
+    if clean_content:
+        on_log(f"🔍 Response Content: {clean_content}...")
+    return exc.kind
+
+def postprocessed(on_log, task, info):
+    """
+    Log a finished post-processing job; returns the final path and the
+    history fields.
+    """
+    if info["final_bytes"] < info["original_bytes"]:
+        on_log(f"🗜️ [{label(task)}] {info['original_bytes'] / 1024:.0f} KB -> "
+               f"{info['final_bytes'] / 1024:.0f} KB")
+    return info["file_path"], postprocess.history_fields(info)
+
+def retry_logger(on_log, task, what):
+    def log(kind, exc, attempt, delay):
+        if kind == resilience.CIRCUIT_OPEN:
+            on_log(f"⏸️ [{label(task)}] {exc}. Waiting {delay:.0f}s for it to close...")
+        else:
+            on_log(f"🔁 [{label(task)}] {what} failed ({kind}: {exc}). Retry {attempt+1} in {delay:.1f}s...")
+    return log
+
+class Pipeline:
+    """
+    Thread-based generation pipeline for one batch. request() and
+    download() may be called from any number of threads: the GUI worker
+    runs them as separate producer and consumer stages, the sequential CLI
+    one request at a time with parallel downloads.
+
+    `wait(seconds)` sleeps for the rate limiter and between retries; if it
+    returns True the wait was interrupted (ABORT) and the step gives up.
+    """
+
+    def __init__(self, key_pool, stream=False, job_store=None, on_log=print, wait=time.sleep):
+        self.key_pool = key_pool
+        self.stream = stream
+        self.job_store = job_store
+        self.on_log = on_log
+        self.wait = wait
+
+    def request(self, task, on_url):
+        """
+        Request one reply for `task`, calling on_url(index, url) for each
+        image URL the moment it is known. A resumed item that already has
+        its URLs is not requested again; its missing images are replayed.
+        Returns (urls, error): the URLs found, and why the request failed
+        (None on success). Failures are retried per
+        resilience.DEFAULT_POLICY behind the model's circuit breaker.
+        """
+        if task.get("urls"):
+            for url in pending_urls(task):
+                on_url(task["urls"].index(url), url)
+            return list(task["urls"]), None
+
+        model = task["model"]
+        found = []
+
+        def found_url(url):
+            found.append(url)
+            on_url(len(found) - 1, url)
+
+        def generate():
+            # Lease the least-loaded healthy key; every call goes through
+            # the per-key/per-model rate limiter
+            with self.key_pool.lease() as key:
+                with metrics.METRICS.timer(model, metrics.CLIENT):
+                    client = key.client
+
+                def create():
+                    # Timed inside the limiter so rate-limit waits don't count
+                    with metrics.METRICS.timer(model, metrics.REQUEST):
+                        return client.chat.completions.create(
+                            model=model,
+                            messages=[{"role": "user", "content": task["prompt"]}],
+                            stream=self.stream
+                        )
+
+                response = rate_limit.limited_call(key.api_key, model, create, wait=self.wait)
+                with metrics.METRICS.timer(model, metrics.EXTRACT):
+                    if self.stream:
+                        # Each URL is handed on as soon as it is complete
+                        image_urls, content = utils.consume_image_stream(response, found_url)
+                    else:
+                        content = response.choices[0].message.content or ""
+                        image_urls = utils.get_image_urls(content)
+                        for url in image_urls:
+                            found_url(url)
+            if not image_urls:
+                kind = rate_limit.classify_reply(key.api_key, model, content)
+                raise resilience.GenerationError(kind, "No image URL found in response.", content)
+
+        error = None
+        try:
+            resilience.call_with_retry(generate, breaker=resilience.BREAKERS.get(model), wait=self.wait,
+                                       on_retry=retry_logger(self.on_log, task, "Request"))
+        except Exception as e:
+            error = log_request_failure(self.on_log, task, e)
+        # Images found before a failure are still worth saving
+        metrics.METRICS.record_request(model, bool(found))
+        checkpoint_request(self.job_store, task, found, error)
+        return found, None if found else error
+
+    def download(self, task, request, index, url, started):
+        """
+        Download one image on the calling thread, then post-process and
+        checkpoint it. Returns a concurrent.futures.Future of its result
+        dict; `status` is "failed" if the download gave up. Post-processing
+        is chained on the process pool, so the caller can start its next
+        download as soon as this returns.
+        """
+        model = task["model"]
+        done = Future()
+        # Reserves the name atomically, so parallel downloads never collide
+        output_file = utils.get_unique_filename(task["output_file"])
+
+        def download():
+            download_started = time.monotonic()
+            try:
+                utils.fetch_image(url, output_file)
+            except Exception as e:
+                raise resilience.GenerationError(resilience.DOWNLOAD, f"Download failed: {e}") from e
+            metrics.METRICS.record_download(model, metrics.file_size(output_file),
+                                            time.monotonic() - download_started)
+
+        try:
+            resilience.call_with_retry(download, wait=self.wait,
+                                       on_retry=retry_logger(self.on_log, task, "Download"))
+        except resilience.GenerationError as e:
+            self.on_log(f"❌ [{label(task)}] Failed to download image {index+1}: {e}")
+            utils.release_filename(output_file)
+            if e.kind not in resilience.UNSETTLED_KINDS:
+                # An aborted download stays pending for --resume
+                checkpoint_download(self.job_store, task, url, None)
+            metrics.METRICS.record_image(model, False)
+            done.set_result(image_result(request, index, error=e.kind, started=started))
+            return done
+
+        def save(file_path, **extra):
+            self.on_log(f"✅ [{label(task)}] Saved to {file_path}")
+            checkpoint_download(self.job_store, task, url, file_path)
+            result = image_result(request, index, file_path, started=started, **extra)
+            metrics.METRICS.record_image(model, True, result["elapsed"])
+            done.set_result(result)
+
+        if not postprocess.enabled(task.get("postprocess")):
+            save(output_file)
+            return done
+
+        submitted = time.monotonic()
+
+        def processed(future):
+            # Runs on the pool's callback thread
+            metrics.METRICS.observe(model, metrics.POSTPROCESS, time.monotonic() - submitted)
+            try:
+                try:
+                    info = future.result()
+                except (Exception, CancelledError) as e:
+                    # CancelledError: the pool was shut down (postprocess.shutdown)
+                    self.on_log(f"⚠️ [{label(task)}] Post-processing failed, keeping original ({e!r}).")
+                    save(output_file)
+                else:
+                    file_path, extra = postprocessed(self.on_log, task, info)
+                    save(file_path, **extra)
+            except BaseException as e:
+                # `done` must always resolve, or whoever waits on it hangs
+                done.set_exception(e)
+
+        try:
+            postprocess.submit(output_file, task["postprocess"]).add_done_callback(processed)
+        except Exception as e:
+            # The pool is shut down or broken; keep the download as it is
+            self.on_log(f"⚠️ [{label(task)}] Post-processing failed, keeping original ({e}).")
+            save(output_file)
+        return done
@@ -1,8 +1,19 @@
+import argparse
+import json
 import os
 import re
-import requests
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from openai import OpenAI
+
+import async_engine
+import metrics
+import pipeline
+import postprocess
+import utils
+from job_store import JobStore
+from key_pool import KeyPool
 
 # ================= 配置区域 (在这里修改参数) =================
 
@@ -22,120 +33,287 @@ OUTPUT_FILE = "cute_girl.png"
 # 4. 批量生成数量 (设置你想一次生成几张图)
 BATCH_SIZE = 5
 
+# 5. 异步模式 (默认开启：整个矩阵的请求和下载在一个事件循环里并发执行；改为 False 或加 --sync 则逐个顺序执行)
+ASYNC_MODE = True
+CONCURRENCY = 20  # 异步模式下同时进行的任务数上限
+
+# 6. 流式模式 (一边接收机器人回复一边查找图片链接，找到就立刻开始下载)
+STREAM = False
+
+# 7. 提示词库文件 (命令行 --titles / --all-titles 从这里读取)
+PROMPTS_FILE = "prompts.json"
+
+# 8. 任务队列文件 (记录每个任务的进度；程序中断后用 --resume 只跑没完成的任务)
+JOBS_FILE = "jobs.db"
+
+# 9. 图片后处理 (下载完成后重新编码以节省空间: None 关闭 / "webp" / "avif" / "png" 优化压缩)
+POSTPROCESS = None
+MAX_DIMENSION = 0  # 最长边上限 (像素)，0 表示保持原尺寸
+
+# 以上均为默认值，也可以通过命令行参数覆盖，例如:
+#   python poe_gen.py --titles "Castle" "Cyberpunk City" --models Flux-Pro DALL-E-3 --count 3
+#   python poe_gen.py --prompts-file jobs.jsonl --models all --concurrency 50
+#   python poe_gen.py --resume
+#   python poe_gen.py --postprocess webp --max-dimension 2048
+
 # =========================================================
 
 # 加载环境变量
 load_dotenv()
 
-def get_unique_filename(filename):
+def slugify(text):
     """
-    如果文件已存在，则在文件名后添加序号。
-    例如: image.png -> image_1.png -> image_2.png
+    把标题转换成可以安全用作文件名的形式。
     """
-    if not os.path.exists(filename):
-        return filename
-    
-    base_name, ext = os.path.splitext(filename)
-    counter = 1
-    
-    while True:
-        new_filename = f"{base_name}_{counter}{ext}"
-        if not os.path.exists(new_filename):
-            return new_filename
-        counter += 1
+    slug = re.sub(r"[^\w\-]+", "_", text.strip()).strip("_")
+    return slug or "image"
 
-def get_image_url(content):
+def load_prompt_library(path, titles=None):
     """
-    从机器人的回复中提取图片链接。
+    从 prompts.json 读取提示词库；titles 为空时返回全部。
+    返回 [{"title": ..., "content": ...}] 列表。
     """
-    # 匹配 Markdown 图片格式 ![alt](url)
-    markdown_regex = r"!\[.*?\]\((.*?)\)"
-    match = re.search(markdown_regex, content)
-    if match:
-        return match.group(1)
-    
-    # 匹配原始 URL (http/https)
-    url_regex = r"(https?://[^\s)]+)"
-    match = re.search(url_regex, content)
-    if match:
-        return match.group(1)
-    
-    return None
+    with open(path, 'r', encoding='utf-8') as f:
+        library = json.load(f)
+
+    if not titles:
+        return library
 
-def download_image(url, output_path):
+    by_title = {p.get("title"): p for p in library}
+    missing = [t for t in titles if t not in by_title]
+    if missing:
+        raise ValueError(f"提示词库中找不到这些标题: {', '.join(missing)}")
+    return [by_title[t] for t in titles]
+
+def load_prompt_jsonl(path):
     """
-    下载图片并保存到本地。
+    从 JSONL 文件读取提示词，每行一个对象: {"title": ..., "content": ...}
+    (也接受 "prompt" 作为 content 的别名)。
     """
-    try:
-        print(f"正在下载图片到: {output_path} ...")
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        with open(output_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        print(f"✅ 图片已成功保存: {output_path}")
-    except Exception as e:
-        print(f"❌ 下载图片失败: {e}")
-
-def main():
-    api_key = os.getenv("POE_API_KEY")
-    if not api_key:
-        print("错误: 未在环境变量中找到 POE_API_KEY。请检查 .env 文件。")
-        return
-
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://api.poe.com/v1"
-    )
+    prompts = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            content = data.get("content") or data.get("prompt")
+            if not content:
+                raise ValueError(f"{path} 第 {line_no} 行缺少 content/prompt 字段")
+            prompts.append({"title": data.get("title") or f"prompt_{line_no}", "content": content})
+    return prompts
 
-    # 去除提示词首尾的空白字符
-    clean_prompt = PROMPT.strip()
-    
-    # 确保输出目录存在
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
-        print(f"已创建输出目录: {OUTPUT_DIR}")
-    
-    print("=" * 50)
-    print(f"开始批量生成任务")
-    print(f"计划生成数量: {BATCH_SIZE}")
-    print(f"模型: {MODEL}")
-    print(f"提示词: {clean_prompt}")
-    print("=" * 50)
+def build_matrix(prompts, models, count, output_dir):
+    """
+    生成任务矩阵: 每个提示词 × 每个模型 × count 张。
+    """
+    tasks = []
+    for prompt in prompts:
+        prefix = slugify(prompt["title"])
+        for model in models:
+            name = f"{prefix}_{slugify(model)}.png" if len(models) > 1 else f"{prefix}.png"
+            for _ in range(count):
+                tasks.append({
+                    "title": prompt["title"],
+                    "model": model,
+                    "prompt": prompt["content"].strip(),
+                    "output_file": os.path.join(output_dir, name),
+                })
+    return tasks
 
-    for i in range(BATCH_SIZE):
-        print(f"\n[正在执行第 {i+1}/{BATCH_SIZE} 次生成任务]")
-        
-        try:
-            # 确定当前任务的输出文件名 (包含路径)
-            full_output_path = os.path.join(OUTPUT_DIR, OUTPUT_FILE)
-            current_output_file = get_unique_filename(full_output_path)
-            
-            # 发送请求给 Poe
-            print("正在发送请求，请稍候...")
-            response = client.chat.completions.create(
-                model=MODEL,
-                messages=[{"role": "user", "content": clean_prompt}],
-                stream=False
-            )
-            
-            content = response.choices[0].message.content
-            # 只打印前100个字符避免刷屏，或者根据需要打印
-            print(f"机器人回复: {content[:100]}..." if len(content) > 100 else f"机器人回复: {content}")
-            
-            image_url = get_image_url(content)
+def run_sequential(key_pool, tasks, stream=False, download_workers=4, job_store=None):
+    """
+    同步模式：逐个执行生成任务；同一条回复里的多张图片并行下载 (每个步骤见 pipeline.Pipeline)。
+    每张图片对应一条结果，同一次请求的图片共享 request_id。
+    传入 job_store 时每个任务的进度都会写入任务队列，中断后可以 --resume 继续。
+    任务带有 postprocess 设置时，下载完成的图片会在进程池里重新编码/缩放。
+    """
+    results = []
+    processing = []
+    # 失败会按类型自动重试 (指数退避)；经过客户端限流；同一模型连续多个任务重试后仍失败会被熔断，熔断期间等待恢复而不是直接失败
+    runner = pipeline.Pipeline(key_pool, stream=stream, job_store=job_store)
+    with ThreadPoolExecutor(max_workers=download_workers) as downloader:
+        for i, task in enumerate(tasks):
+            print(f"\n[正在执行第 {i+1}/{len(tasks)} 次生成任务] 模型: {task['model']}")
+            request = pipeline.new_request(task)
+            started = time.monotonic()
+            downloads = []
             
-            if image_url:
+            def start_download(index, image_url):
+                # 每出现一个图片链接就立刻开始下载 (流式模式下不等回复结束)
                 print(f"找到图片链接: {image_url}")
-                download_image(image_url, current_output_file)
+                downloads.append(downloader.submit(runner.download, task, request, index, image_url, started))
+            
+            if task.get("urls"):
+                # 续跑的任务已经拿到过回复，只补下载还没完成的图片，不再重新请求 (不消耗积分)
+                print("已有图片链接，跳过请求，继续下载...")
             else:
-                print("❌ 在回复中未找到图片链接。")
+                print("正在发送请求，请稍候...")
+            urls, error = runner.request(task, start_download)
+            if not urls:
+                results.append(pipeline.image_result(request, None, error=error, started=started))
+            # 下载完成就开始下一个任务，后处理在进程池里继续
+            processing.extend(future.result() for future in downloads)
+    results.extend(future.result() for future in processing)
+    return results
 
-        except Exception as e:
-            print(f"❌ 第 {i+1} 次生成发生错误: {e}")
+def print_summary(results, elapsed):
+    """
+    打印吞吐量统计: 总体以及按模型拆分。
+    """
+    succeeded = sum(1 for r in results if r["status"] == "success")
+    bytes_saved = sum(r.get("bytes_saved", 0) for r in results)
+    requests_made = len({r.get("request_id") for r in results})
+    per_minute = succeeded / elapsed * 60 if elapsed > 0 else 0.0
 
     print("\n" + "=" * 50)
     print("所有任务执行完毕！")
+    print(f"成功: {succeeded}/{len(results)}    请求数: {requests_made}    耗时: {elapsed:.1f}s    吞吐: {per_minute:.1f} 张/分钟")
+    if bytes_saved:
+        print(f"后处理共节省: {bytes_saved / 1024 / 1024:.1f} MB")
+
+    by_model = {}
+    for r in results:
+        by_model.setdefault(r["model"], []).append(r)
+    snapshot = metrics.METRICS.snapshot()
+    for model, items in sorted(by_model.items()):
+        ok = [r for r in items if r["status"] == "success"]
+        avg = sum(r.get("elapsed", 0.0) for r in ok) / len(ok) if ok else 0.0
+        total = snapshot.get(model, {}).get("stages", {}).get(metrics.TOTAL, {})
+        print(f"  {model:<20} 成功 {len(ok)}/{len(items)}    平均单张耗时 {avg:.1f}s    "
+              f"p50/p95/p99 {total.get('p50', 0):.1f}/{total.get('p95', 0):.1f}/{total.get('p99', 0):.1f}s")
+    print("=" * 50)
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"必须是正整数: {value}")
+    return number
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Poe 批量生图 (无界面)。不带参数时使用文件顶部配置区域的设置。"
+    )
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--titles", nargs="+", metavar="TITLE",
+                        help="从提示词库中按标题选择提示词")
+    source.add_argument("--all-titles", action="store_true",
+                        help="使用提示词库中的全部提示词")
+    source.add_argument("--prompts-file", metavar="JSONL",
+                        help="从 JSONL 文件读取提示词 (每行 {\"title\", \"content\"})")
+    source.add_argument("--prompt", help="直接指定一条提示词")
+    source.add_argument("--resume", action="store_true",
+                        help="继续上次中断的批量任务 (只执行还没完成的部分)")
+    parser.add_argument("--library", default=PROMPTS_FILE,
+                        help=f"提示词库文件 (默认: {PROMPTS_FILE})")
+    parser.add_argument("--models", nargs="+", metavar="MODEL", default=[MODEL],
+                        help=f"模型列表，'all' 表示全部默认模型: {', '.join(utils.DEFAULT_MODELS)}")
+    parser.add_argument("--count", type=int, default=BATCH_SIZE,
+                        help="每个 (提示词, 模型) 组合生成的张数")
+    parser.add_argument("--concurrency", type=positive_int, default=CONCURRENCY,
+                        help="同时进行的任务数上限 (异步模式)")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="图片保存目录")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--async", dest="async_mode", action="store_true", default=ASYNC_MODE,
+                      help="异步并发执行 (默认)")
+    mode.add_argument("--sync", dest="async_mode", action="store_false",
+                      help="逐个顺序执行 (此时 --concurrency 不起作用)")
+    parser.add_argument("--stream", action="store_true", default=STREAM,
+                        help="流式接收回复，图片链接一出现就开始下载")
+    parser.add_argument("--postprocess", choices=sorted(postprocess.FORMATS), default=POSTPROCESS,
+                        help="下载后重新编码图片 (在进程池中执行)")
+    parser.add_argument("--max-dimension", type=int, default=MAX_DIMENSION, metavar="PX",
+                        help="后处理时把最长边缩小到不超过该像素值 (0 表示保持原尺寸)")
+    parser.add_argument("--quality", type=int, default=postprocess.DEFAULT_SETTINGS["quality"],
+                        help="WebP/AVIF 编码质量")
+    parser.add_argument("--keep-metadata", action="store_true",
+                        help="后处理时保留 EXIF/XMP 元数据")
+    parser.add_argument("--jobs-file", default=JOBS_FILE,
+                        help=f"任务队列文件 (默认: {JOBS_FILE})")
+    parser.add_argument("--metrics-file", default=metrics.METRICS_FILE,
+                        help=f"各阶段耗时统计 (Prometheus 文本格式，默认: {metrics.METRICS_FILE})")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # 支持多个 Key (POE_API_KEYS=key1,key2)，请求会分摊到各个 Key 上
+    api_keys = utils.get_api_keys()
+    if not api_keys:
+        print("错误: 未在环境变量中找到 POE_API_KEY / POE_API_KEYS。请检查 .env 文件。")
+        return 1
+
+    # 任务队列: 每个任务的进度都会落盘，已经全部完成的旧任务顺手清理掉
+    job_store = JobStore(args.jobs_file).open()
+    job_store.purge()
+
+    if args.resume:
+        jobs = job_store.unfinished_jobs("cli")
+        tasks = []
+        for job in jobs:
+            for task in job_store.resumable_items(job["id"]):
+                # 续跑时沿用该批任务当初的后处理设置
+                task["postprocess"] = job["settings"].get("postprocess")
+                tasks.append(task)
+        if not tasks:
+            print("没有需要继续的任务。")
+            return 0
+        print(f"继续 {len(jobs)} 个未完成的批量任务，剩余 {len(tasks)} 个生成任务。")
+    else:
+        # 组装提示词列表
+        if args.titles or args.all_titles:
+            prompts = load_prompt_library(args.library, args.titles)
+        elif args.prompts_file:
+            prompts = load_prompt_jsonl(args.prompts_file)
+        elif args.prompt:
+            prompts = [{"title": os.path.splitext(OUTPUT_FILE)[0], "content": args.prompt}]
+        else:
+            prompts = [{"title": os.path.splitext(OUTPUT_FILE)[0], "content": PROMPT}]
+
+        models = utils.DEFAULT_MODELS if args.models == ["all"] else args.models
+        tasks = build_matrix(prompts, models, args.count, args.output_dir)
+        if not tasks:
+            print("没有需要执行的任务。")
+            return 0
+        postprocess_settings = {"format": args.postprocess, "max_dimension": args.max_dimension,
+                                "quality": args.quality, "strip_metadata": not args.keep_metadata}
+        for task in tasks:
+            task["postprocess"] = postprocess_settings
+        job_store.create_job(tasks, source="cli",
+                             settings={"models": models, "count": args.count, "output_dir": args.output_dir,
+                                       "postprocess": postprocess_settings})
+        print(f"提示词: {len(prompts)} 条    模型: {', '.join(models)}    每组: {args.count} 张")
+
+    # 确保输出目录存在，顺便清理上次中断时留下的未完成下载 (.part)
+    for output_dir in sorted({os.path.dirname(task["output_file"]) for task in tasks}):
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+            print(f"已创建输出目录: {output_dir}")
+        elif utils.sweep_partials(output_dir or "."):
+            print(f"已清理 {output_dir} 中未完成的下载文件")
+    
+    print("=" * 50)
+    print(f"开始批量生成任务 ({'异步' if args.async_mode else '同步'}模式)    API Key: {len(api_keys)} 个")
+    print(f"计划生成数量: {len(tasks)}" + (f" (并发: {args.concurrency})" if args.async_mode else ""))
+    print("=" * 50)
+
+    started = time.monotonic()
+    try:
+        if args.async_mode:
+            results = async_engine.run(tasks, api_keys=api_keys, concurrency=args.concurrency,
+                                       stream=args.stream, job_store=job_store)
+        else:
+            results = run_sequential(KeyPool(api_keys), tasks, stream=args.stream, job_store=job_store)
+    except KeyboardInterrupt:
+        print("\n已中断。已完成的部分都已记录，运行 python poe_gen.py --resume 继续。")
+        return 130
+    finally:
+        postprocess.shutdown()
+        job_store.close()
+        metrics.METRICS.write_prometheus(args.metrics_file)
+
+    print_summary(results, time.monotonic() - started)
+    return 0 if all(r["status"] == "success" for r in results) else 1
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
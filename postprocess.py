@@ -0,0 +1,132 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import utils
+
+# Target formats. "png" re-encodes as an optimized PNG.
+FORMATS = {
+    "webp": (".webp", "WEBP"),
+    "avif": (".avif", "AVIF"),
+    "png": (".png", "PNG"),
+}
+
+DEFAULT_SETTINGS = {
+    "format": None,          # None disables post-processing
+    "quality": 85,           # WebP/AVIF quality
+    "max_dimension": 0,      # longest side in pixels; 0 keeps the original size
+    "strip_metadata": True,
+}
+
+# Re-encoding is CPU-bound, so it runs in worker processes (no GIL
+# contention with the GUI or the download threads)
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+_processor = None
+_processor_lock = threading.Lock()
+
+def enabled(settings):
+    return bool(settings and (settings.get("format") or settings.get("max_dimension")))
+
+def process_image(file_path, settings):
+    """
+    Re-encode one image according to `settings` and return
+    {file_path, original_bytes, final_bytes, format}. Runs in a worker
+    process. If the result is not smaller (and was not downscaled), the
+    original file is kept unchanged.
+    """
+    from PIL import Image, features
+
+    settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+    original_bytes = os.path.getsize(file_path)
+    source_ext = os.path.splitext(file_path)[1].lower()
+    target = settings["format"]
+    if target == "avif" and not features.check("avif"):
+        target = "webp"  # this Pillow build cannot write AVIF
+    ext, pil_format = FORMATS.get(target) or (source_ext, None)
+
+    with Image.open(file_path) as im:
+        pil_format = pil_format or im.format
+        max_dimension = settings["max_dimension"]
+        downscaled = bool(max_dimension) and max(im.size) > max_dimension
+        if downscaled:
+            im.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+        else:
+            im.load()
+        if pil_format == "JPEG" and im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+
+        save_args = {}
+        if pil_format in ("WEBP", "AVIF", "JPEG"):
+            save_args["quality"] = settings["quality"]
+        if pil_format == "PNG":
+            save_args["optimize"] = True
+        if pil_format == "WEBP":
+            save_args["method"] = 6
+        # The colour profile is kept either way; EXIF/XMP only on request
+        metadata_keys = ("icc_profile",) if settings["strip_metadata"] else ("icc_profile", "exif", "xmp")
+        for key in metadata_keys:
+            if im.info.get(key):
+                save_args[key] = im.info[key]
+
+        tmp_path = file_path + ".post"
+        im.save(tmp_path, pil_format, **save_args)
+
+    final_bytes = os.path.getsize(tmp_path)
+    if final_bytes >= original_bytes and not downscaled:
+        os.remove(tmp_path)
+        return {"file_path": file_path, "original_bytes": original_bytes,
+                "final_bytes": original_bytes, "format": None}
+
+    if ext == source_ext:
+        final_path = file_path
+    else:
+        # Keep the download's stem (image_3.png -> image_3.webp); this
+        # process has its own allocator, so only fall back to it if that
+        # name is already claimed. Never overwrite.
+        final_path = os.path.splitext(file_path)[0] + ext
+        if not utils.claim_filename(final_path):
+            final_path = utils.get_unique_filename(final_path)
+    os.replace(tmp_path, final_path)
+    if final_path != file_path:
+        utils.release_filename(final_path)  # drop the claim; the file is in place
+        os.remove(file_path)
+    return {"file_path": final_path, "original_bytes": original_bytes,
+            "final_bytes": final_bytes, "format": pil_format.lower()}
+
+def get_processor(max_workers=None):
+    """
+    Return the process-wide pool, starting it on first use.
+    """
+    global _processor
+    with _processor_lock:
+        if _processor is None:
+            # spawn, not fork: forking a process with Qt and worker threads is unsafe
+            _processor = ProcessPoolExecutor(max_workers=max_workers or DEFAULT_WORKERS,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        return _processor
+
+def shutdown():
+    global _processor
+    with _processor_lock:
+        if _processor is not None:
+            _processor.shutdown(wait=False, cancel_futures=True)
+            _processor = None
+
+def submit(file_path, settings):
+    """
+    Queue `file_path` for post-processing; returns a concurrent.futures.Future.
+    """
+    return get_processor().submit(process_image, file_path, settings)
+
+def history_fields(info):
+    """
+    The history record fields describing a post-processing result.
+    """
+    return {
+        "original_bytes": info["original_bytes"],
+        "final_bytes": info["final_bytes"],
+        "bytes_saved": info["original_bytes"] - info["final_bytes"],
+        "postprocess": info["format"],
+    }
@@ -0,0 +1,162 @@
+import asyncio
+import os
+import threading
+import time
+
+import resilience
+
+# Requests per minute. POE_RATE_LIMIT caps each API key; POE_MODEL_RATE_LIMITS
+# optionally caps individual models, e.g. "DALL-E-3=30,Flux-Pro=20".
+DEFAULT_KEY_RATE = 500
+DEFAULT_MODEL_RATE = None
+
+class TokenBucket:
+    """
+    Token bucket with adaptive rate (AIMD): a rate-limit response halves the
+    rate and can pause the bucket for Retry-After seconds; each success
+    creeps the rate back up toward the configured ceiling.
+    """
+
+    def __init__(self, per_minute, burst=None, min_per_minute=1.0):
+        self.ceiling = per_minute / 60.0
+        self.rate = self.ceiling
+        self.min_rate = min_per_minute / 60.0
+        self.capacity = burst if burst is not None else max(1.0, self.ceiling)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now):
+        """
+        Take a token (possibly on credit) and return how long the caller must
+        wait before using it. Callers holding the limiter's lock only.
+        """
+        self.refill(now)
+        self.tokens -= 1
+        wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def penalize(self, now, retry_after=None):
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = min(self.tokens, 0.0)
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+
+    def reward(self):
+        self.rate = min(self.ceiling, self.rate + self.ceiling / 20)
+
+class RateLimiter:
+    """
+    Client-side limiter with one bucket per API key and, where configured,
+    one per (API key, model). A call waits until both allow it.
+    """
+
+    def __init__(self, key_rate=DEFAULT_KEY_RATE, model_rates=None, default_model_rate=DEFAULT_MODEL_RATE):
+        self.key_rate = key_rate
+        self.model_rates = model_rates or {}
+        self.default_model_rate = default_model_rate
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        key_rate = float(os.getenv("POE_RATE_LIMIT") or DEFAULT_KEY_RATE)
+        model_rates = {}
+        for item in (os.getenv("POE_MODEL_RATE_LIMITS") or "").split(","):
+            if "=" in item:
+                model, rate = item.split("=", 1)
+                model_rates[model.strip()] = float(rate)
+        return cls(key_rate, model_rates)
+
+    def bucket_list(self, api_key, model):
+        buckets = []
+        if self.key_rate:
+            if api_key not in self.buckets:
+                self.buckets[api_key] = TokenBucket(self.key_rate)
+            buckets.append(self.buckets[api_key])
+        model_rate = self.model_rates.get(model, self.default_model_rate)
+        if model_rate:
+            key = (api_key, model)
+            if key not in self.buckets:
+                self.buckets[key] = TokenBucket(model_rate)
+            buckets.append(self.buckets[key])
+        return buckets
+
+    def reserve(self, api_key, model):
+        """
+        Reserve a slot for one request; returns the seconds to wait first.
+        """
+        with self.lock:
+            now = time.monotonic()
+            return max([bucket.reserve(now) for bucket in self.bucket_list(api_key, model)] or [0.0])
+
+    def on_rate_limited(self, api_key, model, retry_after=None):
+        with self.lock:
+            now = time.monotonic()
+            for bucket in self.bucket_list(api_key, model):
+                bucket.penalize(now, retry_after)
+
+    def on_success(self, api_key, model):
+        with self.lock:
+            for bucket in self.bucket_list(api_key, model):
+                bucket.reward()
+
+LIMITER = RateLimiter.from_env()
+
+def retry_after_seconds(exc):
+    response = getattr(exc, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def classify_reply(api_key, model, content, limiter=None):
+    """
+    resilience.classify_reply for a reply without images. A reply saying
+    it was rate limited also backs the limiter off: limited_call has
+    already counted the call as a success by the time its text arrives.
+    """
+    kind = resilience.classify_reply(content)
+    if kind == resilience.RATE_LIMITED:
+        (limiter or LIMITER).on_rate_limited(api_key, model)
+    return kind
+
+def limited_call(api_key, model, fn, limiter=None, wait=time.sleep):
+    """
+    Run one generation call fn() through the rate limiter, feeding the
+    outcome back so the limit adapts. `wait` as in resilience.call_with_retry.
+    """
+    limiter = limiter or LIMITER
+    delay = limiter.reserve(api_key, model)
+    if delay > 0 and wait(delay):
+        # Not the model's fault: the breaker releases on ABORTED
+        raise resilience.GenerationError(resilience.ABORTED, "Aborted while waiting for rate limit.")
+    try:
+        value = fn()
+    except Exception as exc:
+        if resilience.classify_exception(exc) == resilience.RATE_LIMITED:
+            limiter.on_rate_limited(api_key, model, retry_after_seconds(exc))
+        raise
+    limiter.on_success(api_key, model)
+    return value
+
+async def limited_call_async(api_key, model, fn, limiter=None):
+    """
+    Async counterpart of limited_call; fn is a coroutine function.
+    """
+    limiter = limiter or LIMITER
+    delay = limiter.reserve(api_key, model)
+    if delay > 0:
+        await asyncio.sleep(delay)
+    try:
+        value = await fn()
+    except Exception as exc:
+        if resilience.classify_exception(exc) == resilience.RATE_LIMITED:
+            limiter.on_rate_limited(api_key, model, retry_after_seconds(exc))
+        raise
+    limiter.on_success(api_key, model)
+    return value
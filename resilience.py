@@ -0,0 +1,261 @@
+import asyncio
+import random
+import sys
+import threading
+import time
+
+# Failure kinds
+TRANSIENT_API = "transient_api"   # connection errors, timeouts, 5xx
+RATE_LIMITED = "rate_limited"     # HTTP 429 or a rate-limit reply from the bot
+POE_TIMEOUT = "poe_timeout"       # bot replied with a timeout/network message
+NO_URL = "no_url"                 # bot replied without any image URL
+DOWNLOAD = "download"             # CDN download failed
+FATAL = "fatal"                   # auth, bad request, unknown model... never retried
+CIRCUIT_OPEN = "circuit_open"     # gave up waiting for an open circuit (ABORT)
+KEYS_EXHAUSTED = "keys_exhausted" # every API key is cooling down or disabled
+ABORTED = "aborted"               # the user stopped the batch mid-wait
+
+RETRYABLE_STATUS = {408, 409, 500, 502, 503, 504}
+# Failures that say nothing about the model's health; the breaker ignores them
+NEUTRAL_KINDS = {RATE_LIMITED, KEYS_EXHAUSTED, ABORTED}
+# Failures that leave the item to be run again on --resume instead of failing it
+UNSETTLED_KINDS = {CIRCUIT_OPEN, KEYS_EXHAUSTED, ABORTED}
+
+class GenerationError(Exception):
+    """
+    A classified failure of one generation step.
+    """
+
+    def __init__(self, kind, message, content=None):
+        super().__init__(message)
+        self.kind = kind
+        self.content = content
+
+class CircuitOpenError(GenerationError):
+    def __init__(self, model):
+        super().__init__(CIRCUIT_OPEN, f"Circuit open for model '{model}': too many consecutive failures")
+        self.model = model
+
+def classify_exception(exc):
+    if isinstance(exc, GenerationError):
+        return exc.kind
+    # Not imported here (it is slow to import); if nothing has imported it
+    # yet, exc cannot be one of its errors
+    openai = sys.modules.get("openai")
+    if openai is None:
+        return FATAL
+    if isinstance(exc, openai.APIConnectionError):  # includes APITimeoutError
+        return TRANSIENT_API
+    if isinstance(exc, openai.APIStatusError):
+        if exc.status_code == 429:
+            return RATE_LIMITED
+        return TRANSIENT_API if exc.status_code in RETRYABLE_STATUS else FATAL
+    return FATAL
+
+def classify_reply(content):
+    """
+    Classify a bot reply that contained no image URL.
+    """
+    lower_content = (content or "").lower()
+    if "rate limit" in lower_content or "too many requests" in lower_content:
+        return RATE_LIMITED
+    if "timeout" in lower_content or "network" in lower_content:
+        return POE_TIMEOUT
+    return NO_URL
+
+class RetryPolicy:
+    """
+    Which failure kinds to retry, how often, and with what backoff
+    (exponential with full jitter).
+    """
+
+    def __init__(self, max_attempts=4, base_delay=2.0, max_delay=60.0,
+                 retry_kinds=(TRANSIENT_API, RATE_LIMITED, KEYS_EXHAUSTED, POE_TIMEOUT, NO_URL, DOWNLOAD)):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_kinds = set(retry_kinds)
+
+    def should_retry(self, kind, attempt):
+        return kind in self.retry_kinds and attempt + 1 < self.max_attempts
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+class CircuitBreaker:
+    """
+    Per-model breaker. Opens after `failure_threshold` consecutive failed
+    tasks (ones that used up their retries) and holds calls back for
+    `cooldown` seconds, then lets a single trial call through (half-open):
+    success closes it, failure re-opens it.
+    """
+
+    # How often callers held back by a half-open trial look again (seconds)
+    TRIAL_POLL = 1.0
+
+    def __init__(self, name, failure_threshold=5, cooldown=60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def retry_after(self):
+        """
+        Seconds until allow() may let a held-back caller through.
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(self.TRIAL_POLL, self.opened_at + self.cooldown - time.monotonic())
+
+    def record_retry(self):
+        """
+        An attempt failed but its task will retry: not counted toward the
+        threshold, except that a failed half-open trial re-opens the circuit.
+        """
+        with self.lock:
+            if self.trial_in_flight:
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+    def release(self):
+        """
+        End an attempt that says nothing about the model's health
+        (e.g. a rate-limit response), freeing a half-open trial slot.
+        """
+        with self.lock:
+            self.trial_in_flight = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+class BreakerRegistry:
+    def __init__(self, **breaker_kwargs):
+        self.breaker_kwargs = breaker_kwargs
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def get(self, model):
+        with self.lock:
+            if model not in self.breakers:
+                self.breakers[model] = CircuitBreaker(model, **self.breaker_kwargs)
+            return self.breakers[model]
+
+# Shared by every worker in the process so all batches see a model's health
+DEFAULT_POLICY = RetryPolicy()
+BREAKERS = BreakerRegistry()
+
+def record_outcome(breaker, kind, retry):
+    """
+    Report a failed attempt to `breaker`; `retry` says whether its task
+    will try again.
+    """
+    if kind in NEUTRAL_KINDS:
+        breaker.release()
+    elif retry:
+        breaker.record_retry()
+    else:
+        breaker.record_failure()
+
+def call_with_retry(fn, policy=DEFAULT_POLICY, breaker=None, wait=time.sleep, on_retry=None):
+    """
+    Call fn() until it succeeds, retrying classified failures with backoff.
+
+    `breaker` (optional) gates every attempt and records the outcome; only
+    a task that gives up counts as a failure. While it is open the call
+    waits out the cooldown (without using up attempts). `wait(seconds)`
+    sleeps between attempts; if it returns True the retry loop stops early
+    (used for ABORT). `on_retry(kind, exc, attempt, delay)` is called
+    before each wait. Re-raises the last error when giving up.
+    """
+    attempt = 0
+    held_back = False
+    while True:
+        if breaker is not None and not breaker.allow():
+            delay = breaker.retry_after()
+            if on_retry and not held_back:
+                on_retry(CIRCUIT_OPEN, CircuitOpenError(breaker.name), attempt, delay)
+            held_back = True
+            if wait(delay):
+                raise CircuitOpenError(breaker.name)
+            continue
+        held_back = False
+        try:
+            value = fn()
+        except Exception as exc:
+            kind = classify_exception(exc)
+            retry = policy.should_retry(kind, attempt)
+            if breaker is not None:
+                record_outcome(breaker, kind, retry)
+            if not retry:
+                raise
+            delay = policy.delay(attempt)
+            if on_retry:
+                on_retry(kind, exc, attempt, delay)
+            if wait(delay):
+                raise GenerationError(ABORTED, f"Aborted before retrying: {exc}") from exc
+            attempt += 1
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return value
+
+async def call_with_retry_async(fn, policy=DEFAULT_POLICY, breaker=None, on_retry=None):
+    """
+    Async counterpart of call_with_retry; fn is a coroutine function.
+    """
+    attempt = 0
+    held_back = False
+    while True:
+        if breaker is not None and not breaker.allow():
+            delay = breaker.retry_after()
+            if on_retry and not held_back:
+                on_retry(CIRCUIT_OPEN, CircuitOpenError(breaker.name), attempt, delay)
+            held_back = True
+            await asyncio.sleep(delay)
+            continue
+        held_back = False
+        try:
+            value = await fn()
+        except Exception as exc:
+            kind = classify_exception(exc)
+            retry = policy.should_retry(kind, attempt)
+            if breaker is not None:
+                record_outcome(breaker, kind, retry)
+            if not retry:
+                raise
+            delay = policy.delay(attempt)
+            if on_retry:
+                on_retry(kind, exc, attempt, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return value
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+import utils
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"x" * 24
+
+@pytest.fixture
+def output(tmp_path):
+    """
+    A claimed output name whose .part file holds the first 10 bytes.
+    """
+    path = str(tmp_path / "image.png")
+    with open(utils.partial_path(path), "wb") as f:
+        f.write(PNG[:10])
+    return path
+
+def part_size(path):
+    return os.path.getsize(utils.partial_path(path))
+
+def write_part(path, data):
+    with open(utils.partial_path(path), "wb") as f:
+        f.write(data)
+
+def test_range_header_only_when_resuming():
+    assert "Range" not in utils.download_headers(0)
+    assert utils.download_headers(10)["Range"] == "bytes=10-"
+
+def test_206_continues_the_part_file(output):
+    headers = {"Content-Range": f"bytes 10-{len(PNG) - 1}/{len(PNG)}"}
+    assert utils.plan_download(output, 206, headers, 10) == ("append", len(PNG))
+    assert part_size(output) == 10
+
+def test_200_after_range_restarts(output):
+    headers = {"Content-Length": str(len(PNG))}
+    assert utils.plan_download(output, 200, headers, 10) == ("write", len(PNG))
+
+def test_200_with_content_encoding_has_no_expected_size(output):
+    headers = {"Content-Length": "12", "Content-Encoding": "gzip"}
+    assert utils.plan_download(output, 200, headers, 0) == ("write", None)
+
+def test_206_offset_mismatch_starts_over(output):
+    headers = {"Content-Range": f"bytes 0-{len(PNG) - 1}/{len(PNG)}"}
+    with pytest.raises(utils.DownloadError):
+        utils.plan_download(output, 206, headers, 10)
+    assert part_size(output) == 0
+
+def test_416_when_complete_is_done(output):
+    write_part(output, PNG)
+    headers = {"Content-Range": f"bytes */{len(PNG)}"}
+    assert utils.plan_download(output, 416, headers, len(PNG)) == ("done", len(PNG))
+    assert part_size(output) == len(PNG)
+
+def test_416_otherwise_starts_over(output):
+    headers = {"Content-Range": f"bytes */{len(PNG) + 5}"}
+    with pytest.raises(utils.DownloadError):
+        utils.plan_download(output, 416, headers, 10)
+    assert part_size(output) == 0
+
+def test_finish_moves_a_complete_image_into_place(output):
+    write_part(output, PNG)
+    utils.finish_download(output, len(PNG))
+    assert not os.path.exists(utils.partial_path(output))
+    with open(output, "rb") as f:
+        assert f.read() == PNG
+
+def test_short_body_is_kept_for_resume(output):
+    with pytest.raises(utils.DownloadError):
+        utils.finish_download(output, len(PNG))
+    assert part_size(output) == 10
+    assert not os.path.exists(output)
+
+def test_oversized_body_starts_over(output):
+    write_part(output, PNG + b"extra")
+    with pytest.raises(utils.DownloadError):
+        utils.finish_download(output, len(PNG))
+    assert part_size(output) == 0
+    assert not os.path.exists(output)
+
+def test_non_image_body_starts_over(output):
+    write_part(output, b"<html>rate limited</html>")
+    with pytest.raises(utils.DownloadError):
+        utils.finish_download(output, None)
+    assert part_size(output) == 0
+    assert not os.path.exists(output)
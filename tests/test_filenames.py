@@ -0,0 +1,47 @@
+import os
+import time
+
+import utils
+
+def touch(path, data=b"", age=0):
+    with open(path, "wb") as f:
+        f.write(data)
+    if age:
+        then = time.time() - age
+        os.utime(path, (then, then))
+
+def test_sweep_removes_only_stale_image_partials(tmp_path):
+    old = utils.STALE_PARTIAL_SECONDS + 60
+    for name in ("image.png.part", "image_3.webp.part"):
+        touch(tmp_path / name, b"x", age=old)
+    touch(tmp_path / "fresh.png.part", b"x")
+    for name in ("__init__.py", ".gitkeep", "notes.part", "image.png"):
+        touch(tmp_path / name, age=old)
+
+    assert utils.sweep_partials(tmp_path) == 2
+    assert sorted(os.listdir(tmp_path)) == [".gitkeep", "__init__.py", "fresh.png.part", "image.png", "notes.part"]
+
+def test_counter_is_shared_across_image_formats(tmp_path):
+    # A previous run whose images were all converted to WebP
+    for name in ("image.webp", "image_1.webp"):
+        touch(tmp_path / name, b"x")
+    allocator = utils.FilenameAllocator()
+    assert allocator.reserve(str(tmp_path / "image.png")) == str(tmp_path / "image_2.png")
+    assert allocator.reserve(str(tmp_path / "image.webp")) == str(tmp_path / "image_3.webp")
+
+def test_image_extensions_cover_postprocess_formats():
+    import postprocess
+    assert {ext for ext, _ in postprocess.FORMATS.values()} <= set(utils.IMAGE_EXTENSIONS)
+
+def test_seed_counts_claimed_part_files(tmp_path):
+    touch(tmp_path / "image.png", b"x")
+    touch(tmp_path / "image_4.png.part")  # a download still in flight
+    allocator = utils.FilenameAllocator()
+    assert allocator.reserve(str(tmp_path / "image.png")) == str(tmp_path / "image_5.png")
+    assert os.path.exists(tmp_path / "image_5.png.part")
+
+def test_reserve_skips_names_claimed_behind_its_back(tmp_path):
+    allocator = utils.FilenameAllocator()
+    assert allocator.reserve(str(tmp_path / "image.png")) == str(tmp_path / "image.png")
+    touch(tmp_path / "image_1.png.part")  # another process got there first
+    assert allocator.reserve(str(tmp_path / "image.png")) == str(tmp_path / "image_2.png")
@@ -0,0 +1,48 @@
+import pytest
+
+import job_store
+from job_store import JobStore
+
+@pytest.fixture
+def store(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db")).open()
+    yield store
+    store.close()
+
+def new_item(store):
+    job_id = store.create_job([{"model": "m", "prompt": "p", "output_file": "out/image.png"}])
+    return job_id, 0
+
+def state(store, job_id):
+    items = store.resumable_items(job_id)
+    return items[0]["state"] if items else None
+
+def test_item_settles_once_every_url_has_an_outcome(store):
+    job_id, seq = new_item(store)
+    store.mark_requested(job_id, seq, ["u1", "u2"])
+    store.mark_downloaded(job_id, seq, "u1", "out/image.png")
+    assert state(store, job_id) == job_store.REQUESTED
+    assert store.resumable_items(job_id)[0]["downloads"] == {"u1": "out/image.png"}
+    store.mark_downloaded(job_id, seq, "u2", None)
+    assert state(store, job_id) is None
+    assert store.unfinished_jobs() == []
+
+def test_item_with_only_failed_downloads_settles_as_failed(store):
+    job_id, seq = new_item(store)
+    store.mark_requested(job_id, seq, ["u1"])
+    store.mark_downloaded(job_id, seq, "u1", None)
+    row = store.conn.execute("SELECT state FROM job_items WHERE job_id = ?", (job_id,)).fetchone()
+    assert row["state"] == job_store.FAILED
+
+def test_pending_item_is_not_settled_by_stray_downloads(store):
+    job_id, seq = new_item(store)
+    store.mark_downloaded(job_id, seq, "u1", "out/image.png")
+    assert state(store, job_id) == job_store.PENDING
+
+def test_downloads_recorded_before_the_urls_still_settle(store):
+    # Streaming: an image can finish before the reply is checkpointed
+    job_id, seq = new_item(store)
+    store.mark_downloaded(job_id, seq, "u1", "out/image.png")
+    store.mark_requested(job_id, seq, ["u1"])
+    row = store.conn.execute("SELECT state FROM job_items WHERE job_id = ?", (job_id,)).fetchone()
+    assert row["state"] == job_store.DOWNLOADED
@@ -0,0 +1,31 @@
+import pytest
+
+import resilience
+from key_pool import ERROR_THRESHOLD, KeyPool
+
+def fail(pool, kind):
+    key = pool.acquire()
+    pool.release(key, resilience.GenerationError(kind, "boom"))
+
+def test_rate_limits_do_not_bench_a_key():
+    pool = KeyPool(["key-a"])
+    for _ in range(ERROR_THRESHOLD * 2):
+        fail(pool, resilience.RATE_LIMITED)
+    assert pool.status()[0]["state"] == "ok"
+
+def test_repeated_errors_bench_a_key():
+    pool = KeyPool(["key-a"])
+    for _ in range(ERROR_THRESHOLD):
+        fail(pool, resilience.TRANSIENT_API)
+    assert pool.status()[0]["state"] == "cooling"
+
+def test_exhausted_pool_does_not_count_against_the_model():
+    pool = KeyPool(["key-a"])
+    for _ in range(ERROR_THRESHOLD):
+        fail(pool, resilience.TRANSIENT_API)
+    breaker = resilience.CircuitBreaker("m", failure_threshold=1)
+    policy = resilience.RetryPolicy(max_attempts=2, base_delay=0)
+    with pytest.raises(resilience.GenerationError) as info:
+        resilience.call_with_retry(pool.acquire, policy, breaker, wait=lambda seconds: False)
+    assert info.value.kind == resilience.KEYS_EXHAUSTED
+    assert not breaker.is_open
@@ -0,0 +1,70 @@
+import pytest
+
+import rate_limit
+import resilience
+
+POLICY = resilience.RetryPolicy(max_attempts=3, base_delay=0)
+
+def flaky(failures, kind=resilience.TRANSIENT_API):
+    """
+    A call that fails `failures` times with `kind`, then succeeds.
+    """
+    calls = []
+    def fn():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise resilience.GenerationError(kind, "boom")
+        return "ok"
+    return fn
+
+def no_wait(seconds):
+    return False
+
+def test_retried_attempts_do_not_open_the_circuit():
+    breaker = resilience.CircuitBreaker("m", failure_threshold=2)
+    for _ in range(5):
+        assert resilience.call_with_retry(flaky(2), POLICY, breaker, wait=no_wait) == "ok"
+    assert not breaker.is_open
+
+def test_tasks_that_give_up_open_the_circuit():
+    breaker = resilience.CircuitBreaker("m", failure_threshold=2)
+    for _ in range(2):
+        with pytest.raises(resilience.GenerationError):
+            resilience.call_with_retry(flaky(3), POLICY, breaker, wait=no_wait)
+    assert breaker.is_open
+
+def test_rate_limits_never_open_the_circuit():
+    breaker = resilience.CircuitBreaker("m", failure_threshold=1)
+    with pytest.raises(resilience.GenerationError):
+        resilience.call_with_retry(flaky(3, resilience.RATE_LIMITED), POLICY, breaker, wait=no_wait)
+    assert not breaker.is_open
+
+def test_open_circuit_waits_out_the_cooldown():
+    breaker = resilience.CircuitBreaker("m", failure_threshold=1, cooldown=30)
+    breaker.record_failure()
+    waits = []
+    def wait(seconds):
+        waits.append(seconds)
+        breaker.opened_at -= seconds  # pretend the time passed
+        return False
+    assert resilience.call_with_retry(flaky(0), POLICY, breaker, wait=wait) == "ok"
+    assert waits and waits[0] == pytest.approx(30, abs=1)
+    assert not breaker.is_open
+
+def test_abort_while_the_circuit_is_open_leaves_the_task_unsettled():
+    breaker = resilience.CircuitBreaker("m", failure_threshold=1)
+    breaker.record_failure()
+    with pytest.raises(resilience.CircuitOpenError) as info:
+        resilience.call_with_retry(flaky(0), POLICY, breaker, wait=lambda seconds: True)
+    assert info.value.kind in resilience.UNSETTLED_KINDS
+
+def test_abort_while_rate_limited_does_not_count_against_the_model():
+    limiter = rate_limit.RateLimiter(key_rate=1)
+    limiter.reserve("key", "m")  # use up the burst so the next call must wait
+    breaker = resilience.CircuitBreaker("m", failure_threshold=1)
+    call = lambda: rate_limit.limited_call("key", "m", flaky(0), limiter, wait=lambda seconds: True)
+    with pytest.raises(resilience.GenerationError) as info:
+        resilience.call_with_retry(call, POLICY, breaker, wait=no_wait)
+    assert info.value.kind == resilience.ABORTED
+    assert info.value.kind in resilience.UNSETTLED_KINDS
+    assert not breaker.is_open
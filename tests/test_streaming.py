@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+import utils
+
+REPLIES = [
+    "Preview: https://cdn.x/thumb_small.jpg\n![full](https://cdn.x/full.png)",
+    "![a](https://cdn.x/a.png)\n\n![b](https://cdn.x/b.webp?sig=1)\n![a](https://cdn.x/a.png)",
+    "Done: https://cdn.x/raw.png and https://cdn.x/other.JPG?x=1",
+    "Here it is: https://cdn.x/no-extension",
+    "Status https://poe.com/status then https://cdn.x/final.gif",
+    "Ends on a URL https://cdn.x/tail.png",
+    "Sorry, I could not generate that image.",
+    "",
+]
+
+def chunkings(text, rng):
+    yield [text]
+    yield list(text)
+    for _ in range(20):
+        cuts = sorted(rng.sample(range(1, len(text)), min(len(text) - 1, rng.randint(1, 8)))) if len(text) > 1 else []
+        bounds = [0] + cuts + [len(text)]
+        yield [text[a:b] for a, b in zip(bounds, bounds[1:])]
+
+def scan(chunks):
+    scanner = utils.StreamingURLScanner()
+    urls = []
+    for chunk in chunks:
+        urls.extend(scanner.feed(chunk))
+    urls.extend(scanner.finish())
+    assert urls == scanner.found
+    return urls
+
+@pytest.mark.parametrize("reply", REPLIES)
+def test_scanner_matches_get_image_urls(reply):
+    rng = random.Random(reply)
+    expected = utils.get_image_urls(reply)
+    for chunks in chunkings(reply, rng):
+        assert scan(chunks) == expected
+
+def test_markdown_urls_are_returned_before_the_stream_ends():
+    scanner = utils.StreamingURLScanner()
+    assert scanner.feed("![a](https://cdn.x/a.png") == []
+    assert scanner.feed(")\nmore text") == ["https://cdn.x/a.png"]
+    assert scanner.finish() == []
+
+def test_raw_urls_are_held_until_finish():
+    scanner = utils.StreamingURLScanner()
+    assert scanner.feed("Preview: https://cdn.x/thumb.jpg\n") == []
+    assert scanner.feed("![full](https://cdn.x/full.png)") == ["https://cdn.x/full.png"]
+    assert scanner.finish() == []
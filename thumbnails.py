@@ -0,0 +1,140 @@
+import hashlib
+import os
+import threading
+
+THUMBNAIL_SIZE = (160, 160)
+MAX_CACHE_BYTES = 200 * 1024 * 1024
+
+class ThumbnailCache:
+    """
+    On-disk thumbnail cache.
+
+    Thumbnails are keyed by the source file's absolute path, mtime and size,
+    so an overwritten image gets a fresh thumbnail automatically. The cache
+    directory is kept under `max_bytes` by evicting the least recently used
+    entries (access refreshes a thumbnail's mtime).
+    """
+
+    def __init__(self, cache_dir, size=THUMBNAIL_SIZE, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.max_bytes = max_bytes
+        self.format = self.ext = None  # chosen on first use, see detect_format
+        self.format_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.total_bytes = None  # computed by the first scan
+
+    def detect_format(self):
+        """
+        WebP when this Pillow build supports it, otherwise JPEG. Deferred
+        so that constructing the cache does not import PIL; the GUI calls it
+        from its background warm-up. Safe to call from any thread.
+        """
+        if self.ext is None:
+            with self.format_lock:
+                if self.ext is None:
+                    from PIL import features
+                    self.format = "WEBP" if features.check("webp") else "JPEG"
+                    # Published last: readers test `ext`
+                    self.ext = ".webp" if self.format == "WEBP" else ".jpg"
+        return self.format
+
+    def key(self, file_path):
+        st = os.stat(file_path)
+        raw = f"{os.path.abspath(file_path)}|{st.st_mtime_ns}|{st.st_size}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def thumbnail_path(self, file_path, detect=True):
+        """
+        Where the thumbnail for file_path lives (whether or not it exists yet).
+        Returns None if the source image is missing, or if the format is
+        not known yet and `detect` is False.
+        """
+        if self.ext is None:
+            if not detect:
+                return None
+            self.detect_format()
+        try:
+            key = self.key(file_path)
+        except OSError:
+            return None
+        return os.path.join(self.cache_dir, key[:2], key + self.ext)
+
+    def get(self, file_path):
+        """
+        Return the cached thumbnail path, or None if it has not been made yet.
+        Called on the GUI thread, so it never imports PIL itself.
+        """
+        thumb_path = self.thumbnail_path(file_path, detect=False)
+        if thumb_path and os.path.exists(thumb_path):
+            try:
+                os.utime(thumb_path)
+            except OSError:
+                pass
+            return thumb_path
+        return None
+
+    def generate(self, file_path):
+        """
+        Create the thumbnail for file_path (if needed) and return its path.
+        Meant to run on a background thread.
+        """
+        thumb_path = self.thumbnail_path(file_path)
+        if thumb_path is None:
+            return None
+        if os.path.exists(thumb_path):
+            return thumb_path
+
+        from PIL import Image
+        os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+        with Image.open(file_path) as im:
+            # Lets JPEG sources decode at reduced size directly
+            im.draft("RGB", self.size)
+            im.thumbnail(self.size)
+            if self.format == "JPEG" or im.mode not in ("RGB", "RGBA"):
+                im = im.convert("RGB" if self.format == "JPEG" else "RGBA")
+            tmp_path = thumb_path + ".tmp"
+            im.save(tmp_path, self.format, quality=80)
+        os.replace(tmp_path, thumb_path)
+
+        self.account(os.path.getsize(thumb_path))
+        return thumb_path
+
+    def account(self, added_bytes):
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = sum(size for _, _, size in self.scan())
+            else:
+                self.total_bytes += added_bytes
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def scan(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, path, st.st_size))
+        return entries
+
+    def evict(self):
+        """
+        Delete least recently used thumbnails until the cache is back under
+        90% of its budget. Caller holds the lock.
+        """
+        target = self.max_bytes * 0.9
+        entries = sorted(self.scan())
+        total = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self.total_bytes = total
@@ -1,62 +1,449 @@
 import os
 import re
-import requests
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
-from openai import OpenAI
+
+# requests and openai are imported where they are first used: together they
+# take longer to import than the rest of the GUI's startup.
 
 load_dotenv()
 
+# POE_BASE_URL points the clients at another OpenAI-compatible server
+# (e.g. the mock server in benchmark.py)
+POE_BASE_URL = os.getenv("POE_BASE_URL") or "https://api.poe.com/v1"
+DEFAULT_MODELS = [
+        "Playground-v2.5",
+        "StableDiffusionXL",
+        "DALL-E-3",
+        "Nano-Banana-Pro",
+        "Qwen-Image",
+        "Flux-Pro"
+    ]
+
+# Download client settings (see configure_downloads)
+DOWNLOAD_POOL_SIZE = 10
+DOWNLOAD_TIMEOUT = (10, 120)       # (connect, read) seconds
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+_download_session = None
+_download_users = {}  # session -> downloads currently using it
+_download_lock = threading.Lock()
+
+# Downloads and every post-processing format (see postprocess.FORMATS)
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".avif", ".gif")
+
+class FilenameAllocator:
+    """
+    Hands out unique output filenames in constant time.
+
+    Keeps the next counter per (directory, stem), seeded by a single
+    directory scan the first time a prefix is seen. The counter is shared
+    by every image extension, so image_3.png keeps its number when
+    post-processing turns it into image_3.webp. Names are
+    reserved by creating their .part file exclusively (see claim_filename),
+    so parallel downloads — even from other processes — never share a
+    name, and nothing appears at the final path until the image is
+    complete.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def seed(self, directory, stem, ext):
+        """
+        Next counter to try: 0 (the bare name) for a fresh prefix, otherwise
+        one past the highest existing suffix in any image format.
+        """
+        exts = "|".join(re.escape(e) for e in sorted(set(IMAGE_EXTENSIONS) | {ext.lower()}))
+        pattern = re.compile(rf"^{re.escape(stem)}(?:_(\d+))?(?:{exts})(?:\.part)?$", re.IGNORECASE)
+        highest = -1
+        try:
+            with os.scandir(directory or ".") as entries:
+                for entry in entries:
+                    match = pattern.match(entry.name)
+                    if match:
+                        highest = max(highest, int(match.group(1) or 0))
+        except FileNotFoundError:
+            pass
+        return highest + 1
+
+    def reserve(self, filename):
+        directory, name = os.path.split(filename)
+        stem, ext = os.path.splitext(name)
+        key = (os.path.abspath(directory or "."), stem)
+
+        with self.lock:
+            if key not in self.counters:
+                self.counters[key] = self.seed(directory, stem, ext)
+            while True:
+                counter = self.counters[key]
+                self.counters[key] = counter + 1
+                candidate = filename if counter == 0 else os.path.join(directory, f"{stem}_{counter}{ext}")
+                if claim_filename(candidate):
+                    return candidate
+                # Taken behind our back (another process); try the next one
+
+_filename_allocator = FilenameAllocator()
+
+def claim_filename(filename):
+    """
+    Atomically claim `filename` by creating an empty filename + ".part"
+    exclusively. Fails if the name is claimed or already exists. The claim
+    is published by renaming the .part file into place (finish_download).
+    """
+    try:
+        fd = os.open(partial_path(filename), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    os.close(fd)
+    if os.path.exists(filename):
+        # Published by another process before we looked
+        discard_partial(filename)
+        return False
+    return True
+
 def get_unique_filename(filename):
     """
-    If file exists, append a counter to the filename.
+    Reserve a unique filename by appending a counter.
     e.g., image.png -> image_1.png -> image_2.png
+    The name is claimed with an empty .part file (see claim_filename); call
+    release_filename() if nothing ends up being written to it.
     """
-    if not os.path.exists(filename):
-        return filename
-    
-    base_name, ext = os.path.splitext(filename)
-    counter = 1
-    
-    while True:
-        new_filename = f"{base_name}_{counter}{ext}"
-        if not os.path.exists(new_filename):
-            return new_filename
-        counter += 1
+    return _filename_allocator.reserve(filename)
+
+def release_filename(filename):
+    """
+    Give up a reserved name, removing its partial download.
+    """
+    discard_partial(filename)
+
+# Downloads untouched this long are leftovers of a crashed or killed run
+STALE_PARTIAL_SECONDS = 3600
+# Names the allocator claims: <stem>[_N].<image ext>.part
+PARTIAL_NAME_RE = re.compile(
+    rf"^.+(?:{'|'.join(re.escape(e) for e in IMAGE_EXTENSIONS)})\.part$", re.IGNORECASE
+)
+
+def sweep_partials(directory, max_age=STALE_PARTIAL_SECONDS):
+    """
+    Remove stale .part files left by downloads that never finished. Only
+    names the allocator hands out are touched, so this is safe to point at
+    a directory that holds other files. Returns the number removed.
+    """
+    cutoff = time.time() - max_age
+    removed = 0
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not PARTIAL_NAME_RE.match(entry.name) or not entry.is_file():
+                    continue
+                if entry.stat().st_mtime > cutoff:
+                    continue
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError:
+                    pass
+    except FileNotFoundError:
+        pass
+    return removed
+
+# Precompiled URL patterns
+MARKDOWN_IMAGE_RE = re.compile(r"!\[[^\]]*\]\(([^)\s]+)\)")
+RAW_URL_RE = re.compile(r"(https?://[^\s)]+)")
+RAW_IMAGE_URL_RE = re.compile(r"(https?://[^\s)]+?\.(?:png|jpe?g|webp|gif)(?:\?[^\s)]*)?)(?=[\s)]|$)", re.IGNORECASE)
+
+def get_image_urls(content):
+    """
+    Extract every distinct image URL from bot response content, in order.
+    Markdown images win; otherwise raw URLs that look like images; otherwise
+    the first raw URL (bots that link an image without an extension).
+    """
+    if not content:
+        return []
+    for pattern in (MARKDOWN_IMAGE_RE, RAW_IMAGE_URL_RE):
+        urls = list(dict.fromkeys(pattern.findall(content)))
+        if urls:
+            return urls
+    match = RAW_URL_RE.search(content)
+    return [match.group(1)] if match else []
 
 def get_image_url(content):
     """
-    Extract image URL from bot response content.
+    Extract the first image URL from bot response content.
     """
-    # Regex for markdown image
-    markdown_regex = r"!\[.*?\]\((.*?)\)"
-    match = re.search(markdown_regex, content)
-    if match:
-        return match.group(1)
-    
-    # Regex for raw URL (http/https)
-    url_regex = r"(https?://[^\s)]+)"
-    match = re.search(url_regex, content)
-    if match:
-        return match.group(1)
-    
-    return None
+    urls = get_image_urls(content)
+    return urls[0] if urls else None
+
+class StreamingURLScanner:
+    """
+    Incrementally scans streamed reply text for image URLs.
+
+    feed() returns each markdown image URL as soon as its closing ')'
+    arrives. Raw URLs are held until finish(), since a markdown image later
+    in the reply would rule them out; this keeps the result identical to
+    get_image_urls() on the full text, however the reply was chunked.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.scan_from = 0
+        self.found = []
+
+    def feed(self, delta):
+        if not delta:
+            return []
+        self.text += delta
+        new_urls = []
+        for match in MARKDOWN_IMAGE_RE.finditer(self.text, self.scan_from):
+            url = match.group(1)
+            if url not in self.found:
+                self.found.append(url)
+                new_urls.append(url)
+            # Complete matches never need rescanning
+            self.scan_from = match.end()
+        return new_urls
+
+    def finish(self):
+        """
+        End of stream: return the URLs get_image_urls() picks that feed()
+        has not returned yet (the raw URLs of a reply without markdown
+        images).
+        """
+        new_urls = [url for url in get_image_urls(self.text) if url not in self.found]
+        self.found.extend(new_urls)
+        return new_urls
+
+def consume_image_stream(stream, on_url):
+    """
+    Read a streaming chat completion to the end, calling on_url(url) the
+    moment each image URL is complete. If the stream breaks after at least
+    one URL was found, stop there instead of failing the whole request.
+    Returns (urls, full text).
+    """
+    scanner = StreamingURLScanner()
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            for url in scanner.feed(chunk.choices[0].delta.content):
+                on_url(url)
+    except Exception:
+        if not scanner.found:
+            raise
+        return scanner.found, scanner.text
+    finally:
+        close = getattr(stream, "close", None)
+        if close:
+            close()
+    for url in scanner.finish():
+        on_url(url)
+    return scanner.found, scanner.text
+
+def configure_downloads(pool_size=None, timeout=None, chunk_size=None):
+    """
+    Tune the shared download client. Changing the pool size rebuilds the
+    session on next use; timeout is a (connect, read) tuple in seconds.
+    """
+    global _download_session, DOWNLOAD_POOL_SIZE, DOWNLOAD_TIMEOUT, DOWNLOAD_CHUNK_SIZE
+    retired = None
+    with _download_lock:
+        if timeout is not None:
+            DOWNLOAD_TIMEOUT = timeout
+        if chunk_size is not None:
+            DOWNLOAD_CHUNK_SIZE = chunk_size
+        if pool_size is not None and pool_size != DOWNLOAD_POOL_SIZE:
+            DOWNLOAD_POOL_SIZE = pool_size
+            # Downloads of other running jobs may still be using the old
+            # session; if so, the last of them closes it (see download_session)
+            if _download_session is not None and _download_session not in _download_users:
+                retired = _download_session
+            _download_session = None
+    if retired is not None:
+        retired.close()
+
+def current_download_session():
+    # Caller holds _download_lock
+    global _download_session
+    if _download_session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=DOWNLOAD_POOL_SIZE, pool_maxsize=DOWNLOAD_POOL_SIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _download_session = session
+    return _download_session
+
+def get_download_session():
+    """
+    Return the process-wide keep-alive session used for image downloads,
+    creating it on first use. Safe to call from any thread.
+    """
+    with _download_lock:
+        return current_download_session()
+
+@contextmanager
+def download_session():
+    """
+    Borrow the shared session for one download. A session replaced by
+    configure_downloads in the meantime is closed when its last borrower
+    is done with it, releasing its pooled sockets.
+    """
+    with _download_lock:
+        session = current_download_session()
+        _download_users[session] = _download_users.get(session, 0) + 1
+    try:
+        yield session
+    finally:
+        with _download_lock:
+            _download_users[session] -= 1
+            retired = _download_users[session] == 0 and session is not _download_session
+            if _download_users[session] == 0:
+                del _download_users[session]
+        if retired:
+            session.close()
+
+# Leading bytes of the image formats the bots return: (offset, signature)
+IMAGE_SIGNATURES = (
+    (0, b"\x89PNG\r\n\x1a\n"),
+    (0, b"\xff\xd8\xff"),        # JPEG
+    (0, b"GIF87a"),
+    (0, b"GIF89a"),
+    (8, b"WEBP"),                # RIFF....WEBP
+    (4, b"ftyp"),                # AVIF / HEIF
+)
+CONTENT_RANGE_RE = re.compile(r"bytes (\d+|\*)(?:-\d+)?/(\d+|\*)")
+
+class DownloadError(IOError):
+    """
+    A download that came back truncated, mismatched or not an image.
+    """
+
+def partial_path(output_path):
+    return output_path + ".part"
+
+def discard_partial(output_path):
+    try:
+        os.remove(partial_path(output_path))
+    except OSError:
+        pass
+
+def reset_partial(output_path):
+    # Start the download over but keep the name claimed
+    open(partial_path(output_path), 'wb').close()
+
+def file_offset(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def download_headers(offset):
+    """
+    Request headers for a download resuming at `offset`. Identity encoding
+    keeps Content-Length comparable with the bytes written.
+    """
+    headers = {"Accept-Encoding": "identity"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+    return headers
+
+def plan_download(output_path, status, headers, offset):
+    """
+    Decide what to do with a response to download_headers(offset).
+    Returns (mode, expected_size): mode is "append" (206 continuing the
+    .part file), "write" (a full body; start over) or "done" (416 because
+    the .part file is already complete). expected_size is None when the
+    server does not say.
+    """
+    match = CONTENT_RANGE_RE.match(headers.get("Content-Range") or "")
+    total = int(match.group(2)) if match and match.group(2) != "*" else None
+    if status == 416:
+        if offset and total == offset:
+            return "done", total
+        reset_partial(output_path)
+        raise DownloadError("requested range not satisfiable")
+    if status == 206:
+        if not match or match.group(1) != str(offset):
+            reset_partial(output_path)
+            raise DownloadError(f"unexpected Content-Range {headers.get('Content-Range')!r}")
+        return "append", total
+    length = headers.get("Content-Length") or ""
+    encoded = (headers.get("Content-Encoding") or "identity") != "identity"
+    return "write", int(length) if length.isdigit() and not encoded else None
+
+def is_image(head):
+    return any(head[offset:offset + len(signature)] == signature for offset, signature in IMAGE_SIGNATURES)
+
+def finish_download(output_path, expected_size):
+    """
+    Verify the .part file and atomically move it to output_path. A short
+    file is kept so the next attempt resumes it; anything else that fails
+    the checks is emptied so the next attempt starts over.
+    """
+    part_path = partial_path(output_path)
+    size = os.path.getsize(part_path)
+    if expected_size is not None and size < expected_size:
+        raise DownloadError(f"connection closed after {size} of {expected_size} bytes")
+    if expected_size is not None and size > expected_size:
+        reset_partial(output_path)
+        raise DownloadError(f"got {size} bytes, expected {expected_size}")
+    with open(part_path, 'rb') as f:
+        head = f.read(16)
+    if not is_image(head):
+        reset_partial(output_path)
+        raise DownloadError("response is not an image")
+    os.replace(part_path, output_path)
+
+def fetch_image(url, output_path):
+    """
+    Download an image to output_path, raising on failure. Bytes land in
+    output_path + ".part" first (the file that claims the name); if it
+    holds data from an interrupted attempt, only the missing bytes are
+    requested (HTTP Range). The file
+    is checked against Content-Length and for an image header before it
+    is renamed into place, so output_path never holds a partial image.
+    """
+    offset = file_offset(partial_path(output_path))
+    with download_session() as session, \
+            session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT, headers=download_headers(offset)) as response:
+        if response.status_code != 416:
+            response.raise_for_status()
+        mode, expected_size = plan_download(output_path, response.status_code, response.headers, offset)
+        if mode != "done":
+            with open(partial_path(output_path), 'ab' if mode == "append" else 'wb') as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+    finish_download(output_path, expected_size)
 
 def download_image(url, output_path):
     """
-    Download image from URL and save to output_path.
-    Returns True if successful, False otherwise.
+    Download image from URL and save to output_path (see fetch_image).
+    Returns True if successful, False otherwise; calling it again after a
+    failure resumes the download.
     """
     try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        with open(output_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        fetch_image(url, output_path)
         return True
     except Exception as e:
         print(f"Failed to download image: {e}")
         return False
 
+def get_api_keys(text=None):
+    """
+    Parse API keys from `text` (comma/space/newline separated), falling back
+    to POE_API_KEYS and then POE_API_KEY from the environment.
+    """
+    for source in (text, os.getenv("POE_API_KEYS"), os.getenv("POE_API_KEY")):
+        keys = [k for k in re.split(r"[\s,;]+", source or "") if k]
+        if keys:
+            return keys
+    return []
+
 def create_client(api_key=None, timeout=None):
     if not api_key:
         api_key = os.getenv("POE_API_KEY")
@@ -64,8 +451,25 @@ def create_client(api_key=None, timeout=None):
     if not api_key:
         raise ValueError("POE_API_KEY not found in environment or arguments.")
 
+    from openai import OpenAI
     return OpenAI(
         api_key=api_key,
-        base_url="https://api.poe.com/v1",
-        timeout=timeout
+        base_url=POE_BASE_URL,
+        timeout=timeout,
+        max_retries=0  # resilience.call_with_retry owns the retry policy
+    )
+
+def create_async_client(api_key=None, timeout=None):
+    if not api_key:
+        api_key = os.getenv("POE_API_KEY")
+    
+    if not api_key:
+        raise ValueError("POE_API_KEY not found in environment or arguments.")
+
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(
+        api_key=api_key,
+        base_url=POE_BASE_URL,
+        timeout=timeout,
+        max_retries=0  # resilience.call_with_retry owns the retry policy
     )